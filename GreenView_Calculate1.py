@@ -1,131 +1,301 @@
-import time
 import os
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 from PIL import Image
-import requests
 from io import BytesIO
+from gsv_api import IMAGE_URL, KeyPool, bounded_map, fetch_image, load_keys
+from image_cache import ImageCache
+from vegetation import VegetationClassification, VegetationClassificationBatch, stack_images
+from pipeline_records import format_line, iter_records, parse_line
+from metrics import METRICS, instrument_stage
 
-def VegetationClassification(img):
+def fetch_heading(task, key_pool, base_url, image_cache=None):
     """
-    Classifies vegetation using the Excess Green Index (ExG).
-    Returns percentage of green pixels.
+    Downloads and decodes one heading of a panorama in a worker thread,
+    going through the image cache when one is given.
+    Returns the image as an array, or None if the download failed.
     """
+    panoID, heading, pitch = task
     try:
-        img = np.asarray(img)
-        if img.shape[2] == 4:  # Remove alpha channel if present
-            img = img[:, :, :3]
-        img = img.astype('float')
-        R, G, B = img[:, :, 0], img[:, :, 1], img[:, :, 2]
-        ExG = 2 * G - R - B
-        binary_mask = ExG > 20  # Empirical threshold
-        green_pixel_count = np.count_nonzero(binary_mask)
-        total_pixels = img.shape[0] * img.shape[1]
-        green_percent = (green_pixel_count / total_pixels) * 100
-        return green_percent
+        if image_cache is not None:
+            content = image_cache.fetch(panoID, heading, key_pool, pitch=pitch, base_url=base_url)
+        else:
+            content = fetch_image(panoID, heading, key_pool, pitch=pitch, base_url=base_url)
+        return np.asarray(Image.open(BytesIO(content)))
     except Exception as e:
-        print(f"[ERROR] Vegetation classification failed: {e}")
-        return -1
+        print(f"[ERROR] Failed to fetch pano: {panoID}, heading: {heading}: {e}")
+        return None
 
-def GreenViewComputing_ogr_6Horizon(GSVinfoFolder, outTXTRoot, greenmonth, key_file):
-    # Load API keys
-    with open(key_file, "r") as f:
-        keylist = [line.strip() for line in f if line.strip()]
-    print('API key list loaded:', keylist)
+def read_pano_metadata(txtfilename, greenmonth):
+    """
+    Reads the panoramas of a metadata file (text in any stage layout, or a
+    .rec record file) taken in one of greenmonth.
 
-    # Define viewing angles
-    headingArr = 360 / 6 * np.array([0, 1, 2, 3, 4, 5])
-    numGSVImg = float(len(headingArr))
-    pitch = 0
+    Return:
+        panoIDLst, panoDateLst, panoLonLst, panoLatLst
+    """
+    panoIDLst = []
+    panoDateLst = []
+    panoLonLst = []
+    panoLatLst = []
 
-    if not os.path.exists(outTXTRoot):
-        os.makedirs(outTXTRoot)
+    for record in iter_records(txtfilename):
+        if not all(field in record for field in ("panoDate", "lat", "lon")):
+            continue
+        panoDate = record["panoDate"]
+        month = panoDate[-2:]
+        if month in greenmonth:
+            panoIDLst.append(record["panoID"])
+            panoDateLst.append(panoDate)
+            panoLonLst.append(record["lon"])
+            panoLatLst.append(record["lat"])
 
-    if not os.path.isdir(GSVinfoFolder):
-        print('[ERROR] GSV metadata folder not found.')
-        return
+    return panoIDLst, panoDateLst, panoLonLst, panoLatLst
 
-    allTxtFiles = os.listdir(GSVinfoFolder)
-    for txtfile in allTxtFiles:
-        if not txtfile.endswith('.txt'):
-            continue
+def read_journal(partialFile):
+    """
+    Counts the result lines of each panoID already computed in a .partial
+    result file. A trailing line cut off by a crash is truncated away so the
+    file can be appended to.
+    """
+    done = Counter()
+    if not os.path.exists(partialFile):
+        return done
+    with open(partialFile, "rb+") as f:
+        data = f.read()
+        complete = data.rfind(b"\n") + 1
+        if complete < len(data):
+            f.truncate(complete)
+    for line in data[:complete].decode("utf-8", errors="replace").splitlines():
+        record = parse_line(line, "greenview")
+        if record is not None:
+            done[record["panoID"]] += 1
+    return done
 
-        txtfilename = os.path.join(GSVinfoFolder, txtfile)
-        with open(txtfilename, "r") as f:
-            lines = f.readlines()
-
-        panoIDLst = []
-        panoDateLst = []
-        panoLonLst = []
-        panoLatLst = []
-
-        for line in lines:
-            line = line.strip()
-            if not line or 'panoID' not in line:
-                continue
-            try:
-                parts = dict(item.strip().split(": ", 1) for item in line.split(" | "))
-                panoID = parts["panoID"]
-                panoDate = parts["panoDate"]
-                month = panoDate[-2:]
-                lat = parts["lat"]
-                lon = parts["lon"]
-                if month in greenmonth:
-                    panoIDLst.append(panoID)
-                    panoDateLst.append(panoDate)
-                    panoLonLst.append(lon)
-                    panoLatLst.append(lat)
-            except Exception as e:
-                print(f"[WARN] Skipping line: {line}\nReason: {e}")
-                continue
-
-        gvTxt = 'GV_' + os.path.basename(txtfile)
-        GreenViewTxtFile = os.path.join(outTXTRoot, gvTxt)
-        print(f'[INFO] Processing file: {GreenViewTxtFile}')
+class GreenViewWorker:
+    """
+    Download and classification state of one process: API key pool, download
+    threads (each with its own pooled HTTP session) and image cache.
+    """
 
-        if os.path.exists(GreenViewTxtFile):
-            print(f'[INFO] Skipping existing file: {gvTxt}')
-            continue
+    def __init__(self, keylist, max_in_flight=24, rate_per_key=10, base_url=IMAGE_URL,
+                 image_cache_root=None, image_cache_bytes=None, offline=False,
+                 classify_threads=None, sync_every=50, progress_seconds=10.0, verbose=False):
+        self.sync_every = sync_every
+        self.progress_seconds = progress_seconds
+        self.verbose = verbose
+        self.key_pool = KeyPool(keylist, rate_per_key)
+        self.executor = ThreadPoolExecutor(max_workers=max_in_flight)
+        self.max_in_flight = max_in_flight
+        self.base_url = base_url
+        self.classify_threads = classify_threads
+        self.image_cache = None
+        if image_cache_root:
+            self.image_cache = ImageCache(image_cache_root, image_cache_bytes, offline)
+
+        # Define viewing angles
+        self.headingArr = 360 / 6 * np.array([0, 1, 2, 3, 4, 5])
+        self.numGSVImg = float(len(self.headingArr))
+        self.pitch = 0
+
+    def process_file(self, txtfilename, GreenViewTxtFile, greenmonth):
+        """
+        Computes the green view of the panoramas of one metadata file. The
+        result is appended pano by pano to a .partial file that is renamed to
+        GreenViewTxtFile only once complete, so an existing GV_*.txt is
+        always a finished one. The .partial file doubles as the journal: after
+        a crash the panoramas it already holds are not fetched again.
+        Returns the number of panoramas processed.
+        """
+        panoIDLst, panoDateLst, panoLonLst, panoLatLst = read_pano_metadata(txtfilename, greenmonth)
+        headingArr = self.headingArr
 
-        with open(GreenViewTxtFile, "w") as gvResTxt:
+        partialFile = GreenViewTxtFile + '.partial'
+        done = read_journal(partialFile)
+        skipped = 0
+        if done:
+            # the journal holds the first lines of the file in order: skip as
+            # many entries of each panoID as it has lines, so a panorama listed
+            # twice in the metadata still gets both of its lines
+            todo = []
+            for i, panoID in enumerate(panoIDLst):
+                if done[panoID] > 0:
+                    done[panoID] -= 1
+                    skipped += 1
+                else:
+                    todo.append(i)
+            print(f'[INFO] Resuming {os.path.basename(GreenViewTxtFile)}: {skipped} panoramas already computed')
+            panoIDLst = [panoIDLst[i] for i in todo]
+            panoDateLst = [panoDateLst[i] for i in todo]
+            panoLonLst = [panoLonLst[i] for i in todo]
+            panoLatLst = [panoLatLst[i] for i in todo]
+
+        # Download every heading of every panorama, at most a few panoramas ahead
+        tasks = ((panoID, heading, self.pitch) for panoID in panoIDLst for heading in headingArr)
+        images = bounded_map(self.executor,
+                             lambda task: fetch_heading(task, self.key_pool, self.base_url, self.image_cache),
+                             tasks, self.max_in_flight * 2)
+
+        fileStart = time.monotonic()
+        lastReport = fileStart
+        with open(partialFile, "a") as gvResTxt:
             for i in range(len(panoIDLst)):
                 panoID = panoIDLst[i]
                 panoDate = panoDateLst[i]
                 lat = panoLatLst[i]
                 lon = panoLonLst[i]
-                key = keylist[i % len(keylist)]
                 greenPercent = 0.0
 
-                for heading in headingArr:
-                    try:
-                        URL = (
-                            f"https://maps.googleapis.com/maps/api/streetview?"
-                            f"size=400x400&pano={panoID}&fov=60&heading={heading}&pitch={pitch}"
-                            f"&sensor=false&key={key}"
-                        )
-                        time.sleep(1)  # avoid rate limiting
-                        response = requests.get(URL)
-                        if response.status_code != 200:
-                            print(f"[ERROR] Failed to fetch pano: {panoID}, status: {response.status_code}")
-                            greenPercent = -1000
-                            break
-
-                        im = Image.open(BytesIO(response.content))
-                        percent = VegetationClassification(im)
+                with METRICS.timer("greenview.wait_images"):
+                    panoImages = [next(images) for heading in headingArr]
+                if any(im is None for im in panoImages):
+                    greenPercent = -1000
+                else:
+                    with METRICS.timer("greenview.classify"):
+                        stack = stack_images(panoImages)
+                        if stack is not None:
+                            percents = VegetationClassificationBatch(stack, self.classify_threads)
+                        else:
+                            percents = [VegetationClassification(im) for im in panoImages]
+                    for percent in percents:
                         if percent == -1:
                             greenPercent = -1000
                             break
-                        greenPercent += percent
+                        greenPercent += float(percent)
+
+                greenViewVal = greenPercent / self.numGSVImg if greenPercent >= 0 else -1
+                METRICS.incr("greenview.panos")
+                if greenViewVal < 0:
+                    METRICS.incr("greenview.failed")
+                if self.verbose:
+                    print(f"[RESULT] Green View Index: {greenViewVal:.2f}, pano: {panoID}, ({lat}, {lon})")
+                now = time.monotonic()
+                if now - lastReport >= self.progress_seconds:
+                    # periodic summary instead of one line per panorama
+                    print(f"[INFO] {os.path.basename(GreenViewTxtFile)}: {i + 1}/{len(panoIDLst)} panoramas "
+                          f"| {(i + 1) / (now - fileStart):.1f} panos/s")
+                    lastReport = now
+                gvResTxt.write(format_line("greenview", {
+                    "panoID": panoID, "panoDate": panoDate, "lon": lon, "lat": lat, "greenview": greenViewVal,
+                }))
+                gvResTxt.flush()
+                if (i + 1) % self.sync_every == 0:
+                    os.fsync(gvResTxt.fileno())
+
+            os.fsync(gvResTxt.fileno())
+        os.replace(partialFile, GreenViewTxtFile)
+        return len(panoIDLst) + skipped
+
+    def close(self):
+        self.executor.shutdown()
+        if self.image_cache is not None:
+            print(f"[INFO] {self.image_cache.stats()}")
+
+# one worker per process of the multi-process driver
+_worker = None
+
+def _init_worker(kwargs):
+    global _worker
+    # a forked worker inherits the parent's counters, which would be merged
+    # back into the parent with this worker's own
+    METRICS.snapshot(reset=True)
+    METRICS.scopes = []
+    _worker = GreenViewWorker(**kwargs)
+    # pool workers end through multiprocessing, which skips atexit hooks but
+    # runs its own finalizers: shut the executor down and report the cache
+    import multiprocessing.util
+    multiprocessing.util.Finalize(None, _worker.close, exitpriority=10)
+
+def _process_file(job):
+    txtfilename, GreenViewTxtFile, greenmonth = job
+    count = _worker.process_file(txtfilename, GreenViewTxtFile, greenmonth)
+    # the metrics of this file go back to the parent process
+    return count, METRICS.snapshot(reset=True)
+
+@instrument_stage("greenview")
+def GreenViewComputing_ogr_6Horizon(GSVinfoFolder, outTXTRoot, greenmonth, key_file,
+                                    max_in_flight=24, rate_per_key=10, base_url=IMAGE_URL,
+                                    image_cache_root=None, image_cache_bytes=None, offline=False,
+                                    classify_threads=None, processes=1, verbose=False):
+    """
+    Computes the green view index of every panorama listed in the metadata
+    files of GSVinfoFolder and writes GV_*.txt result files to outTXTRoot.
+
+    The six headings of many panoramas are downloaded concurrently by
+    max_in_flight threads over pooled connections, each API key limited to
+    rate_per_key requests per second, with retries and backoff. Images are
+    classified as they arrive while later downloads continue. base_url can
+    point to a local image server for testing.
+
+    image_cache_root keeps every downloaded image in a local store (capped at
+    image_cache_bytes with LRU eviction), offline=True only reads from it.
+
+    The six headings of a panorama are classified as one batch,
+    classify_threads optionally splits larger batches across threads.
+
+    processes > 1 hands the metadata files to a pool of worker processes,
+    each with its own HTTP sessions and classifier. The per-key rate limit is
+    shared out between them. Files are reported in sorted order.
+
+    Progress is summarized every few seconds, verbose=True also prints the
+    result of every panorama. metrics_path, metrics_seconds and profile_path
+    enable the JSON metrics file, periodic metrics summaries and cProfile
+    output (see metrics.py).
+    """
+    # Load API keys
+    keylist = load_keys(key_file)
+    print(f'API key list loaded: {len(keylist)} keys')
+    if offline and not image_cache_root:
+        print('[ERROR] Offline mode needs an image cache folder.')
+        return
+
+    if not os.path.exists(outTXTRoot):
+        os.makedirs(outTXTRoot)
+
+    if not os.path.isdir(GSVinfoFolder):
+        print('[ERROR] GSV metadata folder not found.')
+        return
+
+    jobs = []
+    for txtfile in sorted(os.listdir(GSVinfoFolder)):
+        if not txtfile.endswith(('.txt', '.rec')):
+            continue
+
+        txtfilename = os.path.join(GSVinfoFolder, txtfile)
+        gvTxt = 'GV_' + os.path.splitext(txtfile)[0] + '.txt'
+        GreenViewTxtFile = os.path.join(outTXTRoot, gvTxt)
+
+        if os.path.exists(GreenViewTxtFile):
+            print(f'[INFO] Skipping existing file: {gvTxt}')
+            continue
+        jobs.append((txtfilename, GreenViewTxtFile, greenmonth))
 
-                    except Exception as e:
-                        print(f"[ERROR] Failed image fetch/classify: {e}")
-                        greenPercent = -1000
-                        break
+    # the per-key rate is shared out only between processes that actually run
+    workers = min(processes, len(jobs)) if processes > 1 and len(jobs) > 1 else 1
+    worker_args = dict(
+        keylist=keylist, max_in_flight=max_in_flight, rate_per_key=rate_per_key / workers,
+        base_url=base_url, image_cache_root=image_cache_root, image_cache_bytes=image_cache_bytes,
+        offline=offline, classify_threads=classify_threads, verbose=verbose,
+    )
 
-                greenViewVal = greenPercent / numGSVImg if greenPercent >= 0 else -1
-                print(f"[RESULT] Green View Index: {greenViewVal:.2f}, pano: {panoID}, ({lat}, {lon})")
-                gvResTxt.write(
-                    f'panoID: {panoID} panoDate: {panoDate} longitude: {lon} latitude: {lat}, greenview: {greenViewVal:.2f}\n'
-                )
+    if workers > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(worker_args,)) as pool:
+            for job, (count, metrics) in zip(jobs, pool.map(_process_file, jobs)):
+                METRICS.merge(metrics)
+                print(f'[INFO] Finished file: {job[1]} ({count} panoramas)')
+    else:
+        worker = GreenViewWorker(**worker_args)
+        try:
+            for job in jobs:
+                print(f'[INFO] Processing file: {job[1]}')
+                count = worker.process_file(*job)
+                print(f'[INFO] Finished file: {job[1]} ({count} panoramas)')
+        finally:
+            worker.close()
 
 # ------------------------------ Main function -------------------------------
 if __name__ == "__main__":
@@ -135,6 +305,8 @@ if __name__ == "__main__":
     outputTextPath = r'C:\Treepedia_Public-master\spatial-data\greenviewRes'
     greenmonth = ['01','02','03','04','05','06','07','08','09','10','11','12']  # or subset
     key_file = r'C:\Treepedia_Public-master\Treepedia\keys1.txt'
+    imageCacheRoot = r'C:\Treepedia_Public-master\spatial-data\image_cache'
 
-GreenViewComputing_ogr_6Horizon(GSVinfoRoot, outputTextPath, greenmonth, key_file)
+    GreenViewComputing_ogr_6Horizon(GSVinfoRoot, outputTextPath, greenmonth, key_file,
+                                    image_cache_root=imageCacheRoot)
 
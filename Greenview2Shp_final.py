@@ -2,6 +2,8 @@
 # considering the facts many people are more comfortable with shapefile and GIS
 # Copyright(C) Xiaojiang Li, Ian Seiferling, Marwa Abdulhai, Senseable City Lab, MIT 
 
+from metrics import METRICS, instrument_stage
+
 
 def Read_GSVinfo_Text(GVI_Res_txt):
     '''
@@ -24,32 +26,26 @@ def Read_GSVinfo_Text(GVI_Res_txt):
     panoLonLst = []
     panoLatLst = []
     greenViewLst = []
+    seenPanoIDs = set()
     
-    # read the green view index result txt files
-    lines = open(GVI_Res_txt,"r")
-    for line in lines:
-        # check the completeness of each line, each line include attribute of, panoDate, lon, lat,greenView
-        if "panoDate" not in line or "greenview" not in line:
-            continue
-        
-        panoID = line.split(" panoDate")[0][-22:]
-        panoDate = line.split(" longitude")[0][-7:]
-        coordinate = line.split("longitude: ")[1]
-        lon = coordinate.split(" latitude: ")[0]
-        latView = coordinate.split(" latitude: ")[1]
-        lat = latView.split(', greenview:')[0]
-        greenView = line.split("greenview:")[1]
+    from pipeline_records import iter_records
+
+    # read the green view index result records, text or .rec file
+    for record in iter_records(GVI_Res_txt, "greenview"):
+        panoID = record["panoID"]
+        panoDate = record["panoDate"]
+        lon = str(record["lon"])
+        lat = str(record["lat"])
+        greenView = str(record["greenview"])
         
         # check if the greeView data is valid
-        if len(greenView)<2:
-            continue
-        
-        elif float(greenView) < 0:
+        if float(greenView) < 0:
             print (greenView)
             continue
         
         # remove the duplicated panorama id
-        if panoID not in panoIDLst:
+        if panoID not in seenPanoIDs:
+            seenPanoIDs.add(panoID)
             panoIDLst.append(panoID)
             panoDateLst.append(panoDate)
             panoLonLst.append(lon)
@@ -60,6 +56,73 @@ def Read_GSVinfo_Text(GVI_Res_txt):
 
 
 
+# read the green view index files into columns, the input can be file or folder
+def Read_GVI_columns(GVI_Res, chunk_rows=100000):
+    '''
+        This function streams the green view results of a txt/.rec file or of
+        every txt/.rec file in a folder into columnar arrays. Invalid results
+        (greenview < 0) are dropped and duplicated panoramas are removed across
+        all files with a hash set, keeping the first occurrence, so loading
+        stays linear in the number of rows.
+        
+        Return:
+            dict of panoID, panoDate (object arrays) and lon, lat, greenView
+            (float64 arrays)
+        
+        Pamameters:
+            GVI_Res: the file name of the GSV information text, could be folder or txt file
+        '''
+    
+    import os,os.path
+    import numpy as np
+    from pipeline_records import RecordReader, iter_text_records
+    
+    if os.path.isdir(GVI_Res):
+        files = [os.path.join(GVI_Res, name) for name in sorted(os.listdir(GVI_Res))
+                 if name.endswith(('.txt', '.rec'))]
+    else:
+        files = [GVI_Res]
+    
+    seen = set()
+    parts = {'panoID': [], 'panoDate': [], 'lon': [], 'lat': [], 'greenView': []}
+    
+    def add_chunk(panoID, panoDate, lon, lat, greenView):
+        valid = greenView >= 0
+        keep = np.zeros(len(panoID), dtype=bool)
+        for idx in np.flatnonzero(valid):
+            pid = panoID[idx]
+            if pid not in seen:
+                seen.add(pid)
+                keep[idx] = True
+        for name, values in zip(parts, (panoID, panoDate, lon, lat, greenView)):
+            parts[name].append(values[keep])
+    
+    for path in files:
+        if path.endswith('.rec'):
+            with RecordReader(path) as reader:
+                for chunk in reader.iter_chunks():
+                    add_chunk(chunk['panoID'], chunk['panoDate'], chunk['lon'], chunk['lat'], chunk['greenview'])
+            continue
+        
+        buffer = {'panoID': [], 'panoDate': [], 'lon': [], 'lat': [], 'greenview': []}
+        for record in iter_text_records(path, 'greenview'):
+            for name in buffer:
+                buffer[name].append(record[name])
+            if len(buffer['panoID']) >= chunk_rows:
+                add_chunk(*(np.array(buffer[name], dtype=object if name in ('panoID', 'panoDate') else 'float64')
+                            for name in buffer))
+                buffer = {name: [] for name in buffer}
+        if buffer['panoID']:
+            add_chunk(*(np.array(buffer[name], dtype=object if name in ('panoID', 'panoDate') else 'float64')
+                        for name in buffer))
+    
+    columns = {}
+    for name, values in parts.items():
+        dtype = object if name in ('panoID', 'panoDate') else 'float64'
+        columns[name] = np.concatenate(values).astype(dtype) if values else np.empty(0, dtype=dtype)
+    return columns
+
+
 # read the green view index files into list, the input can be file or folder
 def Read_GVI_res(GVI_Res):
     '''
@@ -76,51 +139,155 @@ def Read_GVI_res(GVI_Res):
         last modified by Xiaojiang Li, March 27, 2018
         '''
     
-    import os,os.path
-    
-    # empty list to save the GVI result and GSV metadata
-    panoIDLst = []
-    panoDateLst = []
-    panoLonLst = []
-    panoLatLst = []
-    greenViewLst = []
-    
+    columns = Read_GVI_columns(GVI_Res)
     
-    # if the input gvi result is a folder
-    if os.path.isdir(GVI_Res):
-        allTxtFiles = os.listdir(GVI_Res)
-        
-        for txtfile in allTxtFiles:
-            # only read the text file
-            if not txtfile.endswith('.txt'):
-                continue
-            
-            GVI_Res= os.path.join(GVI_Res,txtfile)
-            
-            # call the function to read txt file to a list
-            [panoIDLst_tem,panoDateLst_tem,panoLonLst_tem,panoLatLst_tem,greenViewLst_tem] = Read_GSVinfo_Text(GVI_Res)
-            
-            panoIDLst = panoIDLst + panoIDLst_tem
-            panoDateLst = panoDateLst + panoDateLst_tem
-            panoLonLst = panoLonLst + panoLonLst_tem
-            panoLatLst = panoLatLst + panoLatLst_tem
-            greenViewLst = greenViewLst + greenViewLst_tem
-
-    else: #for single txt file
-        [panoIDLst_tem,panoDateLst_tem,panoLonLst_tem,panoLatLst_tem,greenViewLst_tem] = Read_GSVinfo_Text(GVI_Res)
-
+    panoIDLst = list(columns['panoID'])
+    panoDateLst = list(columns['panoDate'])
+    panoLonLst = [repr(float(value)) for value in columns['lon']]
+    panoLatLst = [repr(float(value)) for value in columns['lat']]
+    greenViewLst = [repr(float(value)) for value in columns['greenView']]
 
     return panoIDLst,panoDateLst,panoLonLst,panoLatLst,greenViewLst
 
 
 
 
-def CreatePointFeature_ogr(outputShapefile,LonLst,LatLst,panoIDlist,panoDateList,greenViewList,lyrname):
+# output formats by file extension, any other path is a shapefile folder as before
+EXPORT_DRIVERS = {
+    '.shp': 'ESRI Shapefile',
+    '.gpkg': 'GPKG',
+    '.fgb': 'FlatGeobuf',
+    '.geojson': 'GeoJSON',
+}
+
+
+@instrument_stage("export")
+def ExportGreenViewPoints(outputPath,columns,lyrname='greenView',driverName=None,batch_size=50000,spatial_index=True):
+    """
+    Bulk export of green view points to a vector file.
+    Features are written in batched transactions with one reused feature and
+    geometry, fields are set by index, and the spatial index is built once at
+    the end instead of being maintained on every insert. GeoPackage and
+    FlatGeobuf avoid the 2 GB and field width limits of the shapefile.
+    
+    Parameters:
+      outputPath: the output file, the driver is chosen from its extension
+                  (.gpkg, .fgb, .shp, .geojson), a folder gives a shapefile
+      columns: dict of equally long arrays panoID, panoDate, lon, lat and
+               optionally greenView, as returned by 'Read_GVI_columns'
+      lyrname: the layer name
+      driverName: optional OGR driver name overriding the extension
+      batch_size: number of features per transaction
+      spatial_index: build a spatial index after the features are written
+      metrics_path, metrics_seconds, profile_path: JSON metrics file, periodic
+          metrics summaries and cProfile output (see metrics.py)
+    
+    Return:
+        the number of features written
+    """
+    
+    import os
+    import time
+    import numpy as np
+    from osgeo import ogr
+    from osgeo import osr
+    
+    if driverName is None:
+        driverName = EXPORT_DRIVERS.get(os.path.splitext(outputPath)[1].lower(), 'ESRI Shapefile')
+    driver = ogr.GetDriverByName(driverName)
+    if driver is None:
+        raise ValueError(f'OGR driver {driverName} is not available')
+    
+    lon = np.asarray(columns['lon'], dtype='float64')
+    lat = np.asarray(columns['lat'], dtype='float64')
+    panoID = columns['panoID']
+    panoDate = columns['panoDate']
+    greenView = columns.get('greenView')
+    if greenView is None or len(greenView) == 0:
+        greenView = np.full(len(lon), -999.0)
+    else:
+        greenView = np.asarray(greenView, dtype='float64')
+    
+    # in case of the returned panoLon and PanoLat are invalid
+    valid = np.flatnonzero(np.isfinite(lon) & np.isfinite(lat))
+    print ('the number of points is:',len(valid))
+    
+    if os.path.exists(outputPath):
+        driver.DeleteDataSource(outputPath)
+    data_source = driver.CreateDataSource(outputPath)
+    if data_source is None:
+        raise IOError(f'cannot create {outputPath}')
+    
+    targetSpatialRef = osr.SpatialReference()
+    targetSpatialRef.ImportFromEPSG(4326)
+    
+    layerOptions = []
+    if driverName == 'GPKG':
+        # the R-tree is filled in one pass at the end
+        layerOptions = ['SPATIAL_INDEX=NO']
+    elif driverName == 'FlatGeobuf':
+        layerOptions = ['SPATIAL_INDEX=YES' if spatial_index else 'SPATIAL_INDEX=NO']
+    outLayer = data_source.CreateLayer(lyrname, targetSpatialRef, ogr.wkbPoint, options=layerOptions)
+    
+    for name, fieldType in (('PntNum', ogr.OFTInteger), ('panoID', ogr.OFTString),
+                            ('panoDate', ogr.OFTString), ('greenView', ogr.OFTReal)):
+        outLayer.CreateField(ogr.FieldDefn(name, fieldType))
+    
+    featureDefn = outLayer.GetLayerDefn()
+    pntIdx = featureDefn.GetFieldIndex('PntNum')
+    panoIdIdx = featureDefn.GetFieldIndex('panoID')
+    panoDateIdx = featureDefn.GetFieldIndex('panoDate')
+    greenViewIdx = featureDefn.GetFieldIndex('greenView')
+    
+    useTransactions = data_source.TestCapability(ogr.ODsCTransactions)
+    outFeature = ogr.Feature(featureDefn)
+    point = ogr.Geometry(ogr.wkbPoint)
+    
+    for start in range(0, len(valid), batch_size):
+        batchStart = time.perf_counter()
+        if useTransactions:
+            data_source.StartTransaction()
+        for idx in valid[start:start + batch_size].tolist():
+            point.SetPoint_2D(0, lon[idx], lat[idx])
+            outFeature.SetFID(-1)
+            outFeature.SetGeometry(point)
+            outFeature.SetField(pntIdx, idx)
+            outFeature.SetField(panoIdIdx, str(panoID[idx]))
+            outFeature.SetField(panoDateIdx, str(panoDate[idx]))
+            outFeature.SetField(greenViewIdx, float(greenView[idx]))
+            outLayer.CreateFeature(outFeature)
+        if useTransactions:
+            data_source.CommitTransaction()
+        METRICS.observe("export.batch", time.perf_counter() - batchStart)
+        METRICS.incr("export.features", len(valid[start:start + batch_size]))
+    
+    if spatial_index and len(valid) > 0:
+        # the shapefile driver names a single file layer after the file, not lyrname
+        layerName = outLayer.GetName()
+        sql = None
+        if driverName == 'GPKG':
+            geomColumn = outLayer.GetGeometryColumn() or 'geom'
+            sql = f"SELECT gpkgAddSpatialIndex('{layerName}', '{geomColumn}')"
+        elif driverName == 'ESRI Shapefile':
+            sql = f'CREATE SPATIAL INDEX ON "{layerName}"'
+        if sql is not None:
+            with METRICS.timer("export.spatial_index"):
+                result = data_source.ExecuteSQL(sql)
+                if result is not None:
+                    data_source.ReleaseResultSet(result)
+    
+    data_source = None
+    return len(valid)
+
+
+def CreatePointFeature_ogr(outputShapefile,LonLst,LatLst,panoIDlist,panoDateList,greenViewList,lyrname,**metricsArgs):
 
     """
     Create a shapefile based on the template of inputShapefile
     This function will delete existing outpuShapefile and create a new shapefile containing points with
     panoID, panoDate, and green view as respective fields.
+    The features are written through 'ExportGreenViewPoints', so outputShapefile
+    can also be a .gpkg or .fgb file.
     
     Parameters:
     outputShapefile: the file path of the output shapefile name, example 'd:\greenview.shp'
@@ -129,71 +296,33 @@ def CreatePointFeature_ogr(outputShapefile,LonLst,LatLst,panoIDlist,panoDateList
       panoIDlist: the panorama id list
       panoDateList: the panodate list
       greenViewList: the green view index result list, all these lists can be generated from the function of 'Read_GVI_res'
+      metricsArgs: metrics_path, metrics_seconds, profile_path of 'ExportGreenViewPoints'
     
     Copyright(c) Xiaojiang Li, Senseable city lab
     
     last modified by Xiaojiang li, MIT Senseable City Lab on March 27, 2018
     
     """
-
-    from osgeo import ogr
-    from osgeo import osr
-
-    # create shapefile and add the above chosen random points to the shapfile
-    driver = ogr.GetDriverByName("ESRI Shapefile")
-
-    # create new shapefile
-    if os.path.exists(outputShapefile):
-        driver.DeleteDataSource(outputShapefile)
-
-    data_source = driver.CreateDataSource(outputShapefile)
-    targetSpatialRef = osr.SpatialReference()
-    targetSpatialRef.ImportFromEPSG(4326)
-
-    outLayer = data_source.CreateLayer(lyrname, targetSpatialRef, ogr.wkbPoint)
-    numPnt = len(LonLst)
-
-    print ('the number of points is:',numPnt)
-
-    if numPnt > 0:
-        # create a field
-        idField = ogr.FieldDefn('PntNum', ogr.OFTInteger)
-        panoID_Field = ogr.FieldDefn('panoID', ogr.OFTString)
-        panoDate_Field = ogr.FieldDefn('panoDate', ogr.OFTString)
-        greenView_Field = ogr.FieldDefn('greenView',ogr.OFTReal)
-        outLayer.CreateField(idField)
-        outLayer.CreateField(panoID_Field)
-        outLayer.CreateField(panoDate_Field)
-        outLayer.CreateField(greenView_Field)
-        
-        for idx in range(numPnt):
-            #create point geometry
-            point = ogr.Geometry(ogr.wkbPoint)
-
-            # in case of the returned panoLon and PanoLat are invalid
-            if len(LonLst[idx]) < 3:
-                continue      
-        
-            point.AddPoint(float(LonLst[idx]),float(LatLst[idx]))
-            
-            # Create the feature and set values
-            featureDefn = outLayer.GetLayerDefn()
-            outFeature = ogr.Feature(featureDefn)
-            outFeature.SetGeometry(point)
-            outFeature.SetField('PntNum', idx)
-            outFeature.SetField('panoID', panoIDlist[idx])
-            outFeature.SetField('panoDate',panoDateList[idx])
-
-            if len(greenViewList) == 0:
-                outFeature.SetField('greenView',-999)
-            else:
-                outFeature.SetField('greenView',float(greenViewList[idx]))
-
-            outLayer.CreateFeature(outFeature)
-            outFeature.Destroy()
-
-        data_source.Destroy()
-
+    
+    import numpy as np
+    
+    def to_float(value):
+        # in case of the returned panoLon and PanoLat are invalid
+        try:
+            return float(value) if len(str(value)) >= 3 else np.nan
+        except ValueError:
+            return np.nan
+    
+    columns = {
+        'panoID': panoIDlist,
+        'panoDate': panoDateList,
+        'lon': np.array([to_float(value) for value in LonLst], dtype='float64'),
+        'lat': np.array([to_float(value) for value in LatLst], dtype='float64'),
+        'greenView': np.array([float(value) for value in greenViewList], dtype='float64'),
+    }
+    
+    if len(LonLst) > 0:
+        ExportGreenViewPoints(outputShapefile, columns, lyrname, **metricsArgs)
     else:
         print ('You created a empty shapefile')
 
@@ -208,9 +337,10 @@ if __name__ == "__main__":
     inputGVIres = r'C:/Treepedia_Public-master/spatial-data/greenviewRes'
     outputShapefile = r'C:/Treepedia_Public-master/spatial-data/'
     lyrname = 'greenView'
-    [panoIDlist,panoDateList,LonLst,LatLst,greenViewList] = Read_GVI_res(inputGVIres)
-    print ('The length of the panoIDList is:', len(panoIDlist))
+    # a .gpkg or .fgb output path avoids the shapefile size limits
+    columns = Read_GVI_columns(inputGVIres)
+    print ('The length of the panoIDList is:', len(columns['panoID']))
     
-    CreatePointFeature_ogr(outputShapefile,LonLst,LatLst,panoIDlist,panoDateList,greenViewList,lyrname)
+    ExportGreenViewPoints(outputShapefile, columns, lyrname)
 
     print('Done!!!')
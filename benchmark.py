@@ -0,0 +1,397 @@
+# Reproducible performance benchmarks of the pipeline stages
+# Every input is synthetic and seeded: road shapefiles of 1k, 100k or 1M
+# segments, metadata files and green view results. The Street View API is
+# replaced by mock_streetview_server.py running in its own process, so the
+# numbers depend on the code and the machine only, never on Google or quota.
+#
+#   python benchmark.py --suite 1k
+#   python benchmark.py --suite 100k --scenarios points export --repeat 3
+#   python benchmark.py --suite 1k --update-baseline
+#
+# Results go to <workdir>/results_<suite>.json. When benchmarks/baseline_<suite>.json
+# exists every scenario is compared against it and the run exits with status 1
+# if one got slower than the tolerance allows.
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from metrics import METRICS
+
+# workload of every scenario per suite; metadata and green view are capped
+# since they are bound by the (mock) API round trips, not by the network size
+SUITES = {
+    "1k": {"segments": 1000, "metadata_points": 1000, "panoramas": 200, "export_points": 10000},
+    "100k": {"segments": 100000, "metadata_points": 20000, "panoramas": 2000, "export_points": 1000000},
+    "1M": {"segments": 1000000, "metadata_points": 100000, "panoramas": 10000, "export_points": 5000000},
+}
+
+# highway tags of the synthetic roads, about a quarter is filtered out by createPoints
+HIGHWAYS = ["residential", "unclassified", "living_street", "primary", "tertiary", "footway", "service",
+            "['residential', 'unclassified']", "['residential', 'primary']"]
+HIGHWAY_WEIGHTS = [0.5, 0.15, 0.05, 0.08, 0.07, 0.05, 0.05, 0.03, 0.02]
+
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks")
+
+
+# --------------------------------------------------------------- input data
+
+def make_road_network(path, segments, seed=0, origin=(80.6, 16.5)):
+    """
+    Writes a WGS84 road shapefile of random street segments with the osm_id,
+    name and highway fields of an OSMnx export. The area grows with the
+    number of segments so the street density stays city-like.
+    """
+    import fiona
+    from fiona.crs import from_epsg
+
+    rng = np.random.default_rng(seed)
+    side = 0.001 * np.sqrt(segments)  # degrees
+    starts = rng.random((segments, 2)) * side + origin
+    vertices = rng.integers(2, 7, segments)
+    highways = rng.choice(len(HIGHWAYS), segments, p=HIGHWAY_WEIGHTS)
+    schema = {'geometry': 'LineString', 'properties': {'osm_id': 'str', 'name': 'str', 'highway': 'str'}}
+
+    def records():
+        for n in range(segments):
+            # random walk of ~50 m steps
+            steps = rng.uniform(-0.0005, 0.0005, (vertices[n] - 1, 2))
+            coords = np.vstack([starts[n], starts[n] + np.cumsum(steps, axis=0)])
+            yield {
+                'geometry': {'type': 'LineString', 'coordinates': [tuple(c) for c in coords.tolist()]},
+                'properties': {'osm_id': str(n), 'name': f'Street {n % 5000}', 'highway': HIGHWAYS[highways[n]]},
+            }
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with fiona.open(path, 'w', driver='ESRI Shapefile', crs=from_epsg(4326), schema=schema) as output:
+        output.writerecords(records())
+    return path
+
+
+def make_metadata_folder(folder, panoramas, seed=0, per_file=1000):
+    """Writes Pnt_start*_end*.txt metadata files of distinct synthetic panoramas."""
+    from pipeline_records import format_line
+
+    rng = np.random.default_rng(seed)
+    lats = 16.5 + rng.random(panoramas) * 0.1
+    lons = 80.6 + rng.random(panoramas) * 0.1
+    months = rng.integers(1, 13, panoramas)
+    os.makedirs(folder, exist_ok=True)
+    for start in range(0, panoramas, per_file):
+        end = min(start + per_file, panoramas)
+        with open(os.path.join(folder, f"Pnt_start{start}_end{end}.txt"), "w", encoding="utf-8") as f:
+            for n in range(start, end):
+                f.write(format_line("metadata", {
+                    "panoID": f"BENCH{n:09d}", "panoDate": f"2020-{months[n]:02d}",
+                    "lat": float(lats[n]), "lon": float(lons[n]),
+                    "street_id": str(n // 10), "street_name": f"Street {n // 10}", "point_id": n,
+                }))
+    return folder
+
+
+def make_greenview_columns(points, seed=0):
+    """Green view results in the layout of Read_GVI_columns."""
+    rng = np.random.default_rng(seed)
+    panoID = np.array([f"BENCH{n:09d}" for n in range(points)], dtype=object)
+    panoDate = np.array([f"2020-{m:02d}" for m in rng.integers(1, 13, points)], dtype=object)
+    return {
+        "panoID": panoID, "panoDate": panoDate,
+        "lon": 80.6 + rng.random(points) * 0.1, "lat": 16.5 + rng.random(points) * 0.1,
+        "greenView": rng.random(points) * 60,
+    }
+
+
+def write_key_file(path, keys=4):
+    with open(path, "w") as f:
+        f.write("".join(f"BENCHKEY{n:04d}\n" for n in range(keys)))
+    return path
+
+
+def _cached(folder, build):
+    """
+    Builds an input folder once per workdir, the generators are deterministic.
+    It is built under a temporary name, so an interrupted build is redone.
+    """
+    if not os.path.isdir(folder):
+        print(f"[INFO] Generating {folder}")
+        partial = folder + ".partial"
+        shutil.rmtree(partial, ignore_errors=True)
+        build(partial)
+        os.replace(partial, folder)
+    return folder
+
+
+# ---------------------------------------------------------------- scenarios
+# Each scenario gets the suite context and a fresh run folder and returns the
+# number of items it processed. Input preparation is not timed.
+
+def prepare_points(ctx):
+    return {"roads": _roads(ctx)}
+
+
+def bench_points(ctx, inputs, runFolder):
+    from createPoints_final import createPoints
+
+    createPoints(inputs["roads"], os.path.join(runFolder, "points.shp"), ctx["mini_dist"],
+                 workers=ctx["workers"])
+    return METRICS.snapshot()["counters"].get("points.written", 0)
+
+
+def prepare_metadata(ctx):
+    def build(folder):
+        from createPoints_final import createPoints
+        createPoints(_roads(ctx), os.path.join(folder, "points.shp"), ctx["mini_dist"], workers=ctx["workers"])
+
+    folder = os.path.join(ctx["workdir"], f"points_{ctx['segments']}_s{ctx['seed']}")
+    return {"points": os.path.join(_cached(folder, build), "points.shp")}
+
+
+def bench_metadata(ctx, inputs, runFolder):
+    from metadataCollector5_Walkability2 import GSVpanoMetadataCollector
+
+    GSVpanoMetadataCollector(inputs["points"], 1000, runFolder, ctx["key_file"],
+                             max_in_flight=ctx["max_in_flight"], rate_per_key=ctx["rate_per_key"],
+                             base_url=ctx["server"].metadata_url, progress_seconds=60.0,
+                             point_range=(0, ctx["metadata_points"]))
+    return METRICS.snapshot()["counters"].get("metadata.points", 0)
+
+
+def prepare_greenview(ctx):
+    folder = os.path.join(ctx["workdir"], f"metadata_{ctx['panoramas']}_s{ctx['seed']}")
+    return {"metadata": _cached(folder, lambda path: make_metadata_folder(path, ctx["panoramas"], ctx["seed"]))}
+
+
+def bench_greenview(ctx, inputs, runFolder):
+    from GreenView_Calculate1 import GreenViewComputing_ogr_6Horizon
+
+    greenmonth = ['01', '02', '03', '04', '05', '06', '07', '08', '09', '10', '11', '12']
+    GreenViewComputing_ogr_6Horizon(inputs["metadata"], runFolder, greenmonth, ctx["key_file"],
+                                    max_in_flight=ctx["max_in_flight"], rate_per_key=ctx["rate_per_key"],
+                                    base_url=ctx["server"].image_url, processes=ctx["processes"])
+    return METRICS.snapshot()["counters"].get("greenview.panos", 0)
+
+
+def prepare_export(ctx):
+    return {"columns": make_greenview_columns(ctx["export_points"], ctx["seed"])}
+
+
+def bench_export(ctx, inputs, runFolder):
+    from Greenview2Shp_final import ExportGreenViewPoints
+
+    return ExportGreenViewPoints(os.path.join(runFolder, f"greenview.{ctx['export_format']}"), inputs["columns"])
+
+
+# name -> (prepare, run, unit, needs the mock server)
+SCENARIOS = {
+    "points": (prepare_points, bench_points, "points", False),
+    "metadata": (prepare_metadata, bench_metadata, "points", True),
+    "greenview": (prepare_greenview, bench_greenview, "panoramas", True),
+    "export": (prepare_export, bench_export, "features", False),
+}
+
+
+def _roads(ctx):
+    folder = os.path.join(ctx["workdir"], f"roads_{ctx['segments']}_s{ctx['seed']}")
+
+    def build(partial):
+        make_road_network(os.path.join(partial, "roads.shp"), ctx["segments"], ctx["seed"])
+
+    return os.path.join(_cached(folder, build), "roads.shp")
+
+
+def _metrics_summary(state):
+    """Counters and the latency quantiles of a metrics snapshot, without the buckets."""
+    return {
+        "counters": state["counters"],
+        "histograms": {name: {k: h[k] for k in ("count", "mean", "p50", "p90", "p99")}
+                       for name, h in state["histograms"].items()},
+    }
+
+
+def run_scenario(name, ctx, repeat=1, keep=False):
+    """
+    Runs one scenario repeat times, each in a fresh folder so no resume logic
+    kicks in. Return: result dict, or {"skipped": reason} when a dependency
+    of the stage is not installed.
+    """
+    prepare, run, unit, _ = SCENARIOS[name]
+    try:
+        inputs = prepare(ctx)
+    except ImportError as e:
+        print(f"[WARN] Skipping {name}: {e}")
+        return {"skipped": str(e)}
+
+    runs = []
+    items = 0
+    state = None
+    for n in range(repeat):
+        runFolder = tempfile.mkdtemp(prefix=f"{name}_", dir=ctx["workdir"])
+        METRICS.snapshot(reset=True)
+        try:
+            start = time.perf_counter()
+            items = run(ctx, inputs, runFolder) or 0
+            runs.append(time.perf_counter() - start)
+        except ImportError as e:
+            print(f"[WARN] Skipping {name}: {e}")
+            return {"skipped": str(e)}
+        finally:
+            state = METRICS.snapshot(reset=True)
+            if not keep:
+                shutil.rmtree(runFolder, ignore_errors=True)
+        print(f"[INFO] {name} run {n + 1}/{repeat}: {runs[-1]:.2f} s, {items} {unit}")
+
+    seconds = statistics.median(runs)
+    return {
+        "seconds": round(seconds, 4),
+        "runs": [round(r, 4) for r in runs],
+        "items": items,
+        "unit": unit,
+        "rate": round(items / seconds, 2) if seconds > 0 else None,
+        "metrics": _metrics_summary(state),
+    }
+
+
+def environment():
+    """Machine and code version the results were measured on."""
+    import subprocess
+
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        "python": platform.python_version(), "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(), "cpu_count": os.cpu_count(),
+        "numpy": np.__version__, "commit": commit or None,
+    }
+
+
+def run_suite(suite, workdir, scenarios=tuple(SCENARIOS), repeat=1, latency=0.05, jitter=0.0,
+              workers=None, processes=1, max_in_flight=32, mini_dist=20, export_format="gpkg",
+              seed=0, keep=False):
+    """
+    Runs the scenarios of a suite (see SUITES) in workdir, where the
+    generated inputs are kept for the next runs.
+
+    Parameters:
+        latency, jitter: delay of the mock Street View server per request
+        workers: createPoints sampling processes, defaults to the number of cores
+        processes: green view worker processes
+        max_in_flight: concurrent API requests of the metadata and green view stages
+        export_format: gpkg, fgb, shp or geojson
+
+    Return:
+        results dict, as written to results_<suite>.json
+    """
+    config = {
+        **SUITES[suite], "latency": latency, "jitter": jitter, "workers": workers or os.cpu_count(),
+        "processes": processes, "max_in_flight": max_in_flight, "mini_dist": mini_dist,
+        "export_format": export_format, "seed": seed, "repeat": repeat,
+    }
+    os.makedirs(workdir, exist_ok=True)
+    ctx = {**config, "workdir": workdir, "rate_per_key": 100000,
+           "key_file": write_key_file(os.path.join(workdir, "keys.txt")), "server": None}
+
+    results = {"suite": suite, "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+               "environment": environment(), "config": config, "scenarios": {}}
+    server = None
+    try:
+        if any(SCENARIOS[name][3] for name in scenarios):
+            from mock_streetview_server import MockStreetViewServer
+            server = ctx["server"] = MockStreetViewServer(process=True, latency=latency, jitter=jitter,
+                                                          seed=seed).start()
+            print(f"[INFO] Mock Street View server on {server.root}")
+        for name in scenarios:
+            print(f"[INFO] ---- {suite}/{name} ----")
+            results["scenarios"][name] = run_scenario(name, ctx, repeat, keep)
+    finally:
+        if server is not None:
+            server.stop()
+    return results
+
+
+def compare(results, baseline, tolerance=0.2):
+    """
+    Compares the scenario times of results with a baseline.
+
+    Return:
+        list of the names of the scenarios slower than baseline * (1 + tolerance)
+    """
+    changed = [key for key in sorted(set(baseline.get("config", {})) | set(results["config"]))
+               if key != "repeat" and baseline.get("config", {}).get(key) != results["config"].get(key)]
+    if changed:
+        print("[WARN] The baseline was measured with a different configuration:")
+        for key in changed:
+            print(f"    {key}: {baseline.get('config', {}).get(key)} -> {results['config'].get(key)}")
+
+    regressions = []
+    for name, result in results["scenarios"].items():
+        old = baseline.get("scenarios", {}).get(name)
+        if "seconds" not in result or not old or "seconds" not in old:
+            continue
+        seconds, reference = result["seconds"], old["seconds"]
+        if old.get("items") and result.get("items") and old["items"] != result["items"]:
+            # different workload, compare the time per item
+            seconds, reference = seconds / result["items"], reference / old["items"]
+        change = seconds / reference - 1 if reference > 0 else 0.0
+        result["baseline_change"] = round(change, 4)
+        if change > tolerance:
+            regressions.append(name)
+            print(f"⚠️ {name}: {result['seconds']:.2f} s vs baseline {old['seconds']:.2f} s ({change:+.1%}) REGRESSION")
+        else:
+            print(f"✅ {name}: {result['seconds']:.2f} s vs baseline {old['seconds']:.2f} s ({change:+.1%})")
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks of the walkability pipeline stages on synthetic data")
+    parser.add_argument("--suite", choices=list(SUITES), default="1k", help="size of the road network")
+    parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--workdir", default="benchmark_data", help="folder of the generated inputs and results")
+    parser.add_argument("--repeat", type=int, default=1, help="runs per scenario, the median is reported")
+    parser.add_argument("--latency", type=float, default=0.05, help="mock API latency per request in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="extra random mock API latency in seconds")
+    parser.add_argument("--workers", type=int, help="point sampling processes (default: all cores)")
+    parser.add_argument("--processes", type=int, default=1, help="green view worker processes")
+    parser.add_argument("--max-in-flight", type=int, default=32, help="concurrent API requests")
+    parser.add_argument("--export-format", choices=["gpkg", "fgb", "shp", "geojson"], default="gpkg")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--keep", action="store_true", help="keep the output folders of the runs")
+    parser.add_argument("--baseline", help="baseline JSON (default: benchmarks/baseline_<suite>.json)")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown against the baseline")
+    parser.add_argument("--update-baseline", action="store_true", help="store the results as the new baseline")
+    return parser.parse_args(argv)
+
+
+# ------------------------------ Main function -------------------------------
+if __name__ == "__main__":
+    args = parse_args()
+    results = run_suite(args.suite, args.workdir, args.scenarios, args.repeat, args.latency, args.jitter,
+                        args.workers, args.processes, args.max_in_flight, export_format=args.export_format,
+                        seed=args.seed, keep=args.keep)
+
+    baselinePath = args.baseline or os.path.join(BASELINE_DIR, f"baseline_{args.suite}.json")
+    regressions = []
+    if not args.update_baseline and os.path.exists(baselinePath):
+        with open(baselinePath, "r") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+
+    resultsPath = os.path.join(args.workdir, f"results_{args.suite}.json")
+    with open(resultsPath, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"[INFO] Results written to {resultsPath}")
+    if args.update_baseline:
+        os.makedirs(os.path.dirname(os.path.abspath(baselinePath)), exist_ok=True)
+        with open(baselinePath, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"[INFO] Baseline updated: {baselinePath}")
+    sys.exit(1 if regressions else 0)
@@ -0,0 +1,132 @@
+# Point-level checkpoints for the long running pipeline stages
+# A bitmap of completed point indices plus the committed size of every output
+# file, saved atomically so a crash never leaves a half written checkpoint.
+
+import base64
+import glob
+import json
+import os
+import re
+import zlib
+
+
+def atomic_write(path, data):
+    """
+    Writes data (str or bytes) to path through a temporary file in the same
+    folder and an atomic rename, so readers see either the old or the new file.
+    """
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    mode = "wb" if isinstance(data, bytes) else "w"
+    with open(tmp_path, mode) as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class PointCheckpoint:
+    """
+    Tracks which point indices of [start, end) are done.
+
+    Several processes may work on disjoint ranges of the same layer at the
+    same time, each one keeps its own checkpoint_<start>_<end>.json in folder.
+    Points completed by any checkpoint in the folder count as done, so a layer
+    can be resumed with a different split. The committed sizes of the output
+    files are merged the same way: disjoint ranges never write the same file,
+    so a file known to several checkpoints comes from an earlier split, and
+    since committed sizes only grow the largest one is the current one.
+    """
+
+    def __init__(self, folder, start, end):
+        self.start = start
+        self.end = end
+        self.path = os.path.join(folder, f"checkpoint_{start}_{end}.json")
+        self.bits = bytearray((end - start + 7) // 8)
+        self.offsets = {}
+
+        for other in glob.glob(os.path.join(folder, "checkpoint_*_*.json")):
+            state = self._read(other)
+            if state is None:
+                continue
+            for filename, offset in state["offsets"].items():
+                if offset is not None and offset > (self.offsets.get(filename) or 0):
+                    self.offsets[filename] = offset
+            self._merge(state)
+
+    @staticmethod
+    def _read(path):
+        try:
+            with open(path, "r") as f:
+                state = json.load(f)
+            state["bits"] = bytearray(zlib.decompress(base64.b64decode(state["done"])))
+            return state
+        except (OSError, ValueError, KeyError, zlib.error):
+            print(f"⚠️ Ignoring unreadable checkpoint: {path}")
+            return None
+
+    def _merge(self, state):
+        lo = max(self.start, state["start"])
+        hi = min(self.end, state["end"])
+        bits = state["bits"]
+        for i in range(lo, hi):
+            k = i - state["start"]
+            if bits[k >> 3] & (1 << (k & 7)):
+                self._set(i)
+
+    def _set(self, i):
+        k = i - self.start
+        self.bits[k >> 3] |= 1 << (k & 7)
+
+    def is_done(self, i):
+        k = i - self.start
+        return bool(self.bits[k >> 3] & (1 << (k & 7)))
+
+    def count_done(self):
+        return sum(bin(b).count("1") for b in self.bits)
+
+    def offset(self, filename):
+        """Committed size of an output file, None if nothing was committed yet."""
+        return self.offsets.get(filename)
+
+    def commit(self, indices, filename=None, offset=None):
+        """Marks indices as done, records the committed file size and saves."""
+        for i in indices:
+            self._set(i)
+        if filename is not None:
+            self.offsets[filename] = offset
+        self.save()
+
+    def save(self):
+        state = {
+            "start": self.start,
+            "end": self.end,
+            "offsets": self.offsets,
+            "done": base64.b64encode(zlib.compress(bytes(self.bits))).decode("ascii"),
+        }
+        atomic_write(self.path, json.dumps(state))
+
+    def import_resume_log(self, log_path):
+        """
+        Converts a legacy resume_status.log ("Pnt_start<s>_end<e>.txt,index")
+        into this checkpoint: all points before the logged index are marked
+        done and the batch files up to the logged one keep their current size.
+        Batch starts are compared as numbers, not as file name strings.
+        """
+        with open(log_path, "r") as f:
+            fields = f.read().strip().split(",")
+        match = re.match(r"Pnt_start(\d+)_end(\d+)\.txt", fields[0])
+        if not match or len(fields) < 2:
+            return False
+        file_start = int(match.group(1))
+        resume_index = int(fields[1])
+
+        folder = os.path.dirname(log_path)
+        done = range(self.start, max(self.start, min(self.end, resume_index)))
+        for name in os.listdir(folder):
+            m = re.match(r"Pnt_start(\d+)_end(\d+)\.txt$", name)
+            if m and int(m.group(1)) <= file_start:
+                self.offsets[name] = os.path.getsize(os.path.join(folder, name))
+        if len(fields) > 2:
+            self.offsets[fields[0]] = int(fields[2])
+        self.commit(done)
+        return True
@@ -0,0 +1,341 @@
+# End-to-end city run: roads -> points -> metadata -> green view -> export
+# The stages overlap: sample points stream into the metadata lookups batch by
+# batch, and every panorama found goes straight on to the image pipeline, so
+# the first green view results arrive minutes after the start instead of after
+# the whole city has been sampled and collected.
+#
+#   python city_pipeline.py --config city.json
+#   python city_pipeline.py --roads roads.shp --out city_run --keys keys1.txt
+#
+# Every stage resumes on its own: finished metadata batches are not queried
+# again and panoramas already in the result files are not downloaded again.
+
+import argparse
+import json
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+
+from checkpoint import atomic_write
+from gsv_api import IMAGE_URL, METADATA_URL
+from street_pipeline import _DONE, _Stage, _put, iter_queue
+
+DEFAULTS = {
+    "city": None,
+    "roads": None,
+    "output": None,
+    "key_file": None,
+    "mini_dist": 20,
+    "batch_size": 1000,
+    "segment_chunk": 2000,
+    "greenmonth": ['01', '02', '03', '04', '05', '06', '07', '08', '09', '10', '11', '12'],
+    "analyzers": ["greenview"],
+    "metadata_url": METADATA_URL,
+    "image_url": IMAGE_URL,
+    "metadata_in_flight": 16,
+    "image_in_flight": 24,
+    "rate_per_key": 10,
+    "metadata_cache": None,  # None: <output>/metadata/cache.sqlite, False: no cache
+    "image_cache": None,
+    "graph_cache": None,
+    "export": "greenview.gpkg",
+    "queue_size": 64,
+    "progress_seconds": 10.0,
+}
+
+class StageProgress:
+    """
+    Thread safe per-stage counters. A reporter thread prints one summary line
+    every interval seconds and keeps progress.json in the output folder up to date.
+    """
+
+    def __init__(self, path, interval=10.0):
+        self.path = path
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.stages = {}
+        self.start = time.monotonic()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._report_loop, daemon=True)
+
+    def add(self, stage, counter, amount=1):
+        with self.lock:
+            counters = self.stages.setdefault(stage, {"status": "running"})
+            counters[counter] = counters.get(counter, 0) + amount
+
+    def status(self, stage, status):
+        with self.lock:
+            self.stages.setdefault(stage, {})["status"] = status
+
+    def snapshot(self):
+        with self.lock:
+            return {"elapsed": round(time.monotonic() - self.start, 1),
+                    "stages": {stage: dict(counters) for stage, counters in self.stages.items()}}
+
+    def report(self):
+        state = self.snapshot()
+        parts = []
+        for stage, counters in state["stages"].items():
+            values = " ".join(f"{name} {value}" for name, value in counters.items() if name != "status")
+            parts.append(f"{stage} [{counters.get('status')}] {values}".strip())
+        print(f"📈 {state['elapsed']:.0f}s | " + " | ".join(parts))
+        atomic_write(self.path, json.dumps(state, indent=2))
+
+    def _report_loop(self):
+        while not self.stop_event.wait(self.interval):
+            self.report()
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop_event.set()
+        self.thread.join()
+        self.report()
+
+
+def stream_points(roads, pointsFolder, mini_dist, batch_size, segment_chunk, progress, stop, out):
+    """
+    Points stage: samples the roads a chunk of segments at a time and puts
+    (start, end, points) batches of batch_size points on out, numbered as
+    createPoints numbers them. The complete points shapefile is written at
+    the end. Sampling is deterministic, so a rerun yields the same batches.
+    Gives up without writing anything once stop is set.
+    """
+    from street_sampler import EXCLUDED_HIGHWAYS, iter_clean_segments, sample_segments, to_lonlat, write_points
+
+    segments = list(iter_clean_segments(roads, EXCLUDED_HIGHWAYS))
+    progress.add("points", "segments", len(segments))
+
+    lons, lats, owners = [], [], []
+    pending = []
+    next_id = 0
+    for first in range(0, len(segments), segment_chunk):
+        x, y, seg_idx = sample_segments(segments[first:first + segment_chunk], mini_dist)
+        seg_idx = seg_idx + first
+        lon, lat = to_lonlat(x, y)
+        lons.append(lon)
+        lats.append(lat)
+        owners.append(seg_idx)
+        for n in range(len(lon)):
+            _, street_id, street_name = segments[seg_idx[n]]
+            pending.append((float(lat[n]), float(lon[n]), next_id, str(street_id), str(street_name), next_id))
+            next_id += 1
+            if len(pending) == batch_size:
+                if not _put(out, (next_id - batch_size, next_id, pending), stop):
+                    return
+                progress.add("points", "points", batch_size)
+                pending = []
+    if pending:
+        if not _put(out, (next_id - len(pending), next_id, pending), stop):
+            return
+        progress.add("points", "points", len(pending))
+    if not _put(out, _DONE, stop):
+        return
+
+    if lons:
+        os.makedirs(pointsFolder, exist_ok=True)
+        write_points(pointsFolder, np.concatenate(lons), np.concatenate(lats), np.concatenate(owners), segments)
+    progress.status("points", "done")
+
+
+def collect_metadata(metadataFolder, key_file, metadata_url, max_in_flight, rate_per_key, cache_path,
+                     progress, stop, inq, out):
+    """
+    Metadata stage: looks up every point batch and writes it to
+    Pnt_start<s>_end<e>.txt like GSVpanoMetadataCollector. A batch file is
+    written as .partial and renamed once every point got an answer, so a
+    rerun skips finished batches (their panoramas are still passed on) and
+    redoes the others, answering earlier points from the metadata cache.
+    Every panorama found is put on out right away. Gives up once stop is
+    set, leaving the current batch to the next run.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from gsv_api import KeyPool, load_keys
+    from metadata_cache import MetadataCache
+    from metadataCollector5_Walkability2 import lookup_point
+    from pipeline_records import format_line, iter_records
+
+    os.makedirs(metadataFolder, exist_ok=True)
+    key_pool = KeyPool(load_keys(key_file), rate_per_key)
+    cache = MetadataCache(cache_path) if cache_path else None
+    executor = ThreadPoolExecutor(max_workers=max_in_flight)
+    incomplete = 0
+    try:
+        for start, end, points in iter_queue(inq, stop):
+            path = os.path.join(metadataFolder, f"Pnt_start{start}_end{end}.txt")
+            if os.path.exists(path):
+                for record in iter_records(path):
+                    if not _put(out, record, stop):
+                        return
+                progress.add("metadata", "skipped", len(points))
+                continue
+
+            failed = 0
+            with open(path + ".partial", "w", encoding="utf-8") as f:
+                results = executor.map(lambda pnt: lookup_point(pnt, key_pool, metadata_url, cache), points)
+                for (lat, lon, point_id, street_id, street_name, _), result in results:
+                    status = result.get("status") if result is not None else None
+                    if status in ("ZERO_RESULTS", "NOT_FOUND"):
+                        progress.add("metadata", "no_pano")
+                        continue
+                    if status != "OK":
+                        failed += 1
+                        progress.add("metadata", "errors")
+                        continue
+                    record = {
+                        "panoID": result.get("pano_id"), "panoDate": result.get("date", "None"),
+                        "lat": lat, "lon": lon, "street_id": street_id,
+                        "street_name": street_name if street_name else "None", "point_id": point_id,
+                    }
+                    f.write(format_line("metadata", record))
+                    if not _put(out, record, stop):
+                        return
+                    progress.add("metadata", "panos")
+                f.flush()
+                os.fsync(f.fileno())
+            if failed == 0:
+                os.replace(path + ".partial", path)
+            else:
+                incomplete += 1
+            progress.add("metadata", "points", len(points))
+    finally:
+        executor.shutdown()
+        if cache is not None:
+            cache.close()
+        _put(out, _DONE, stop)
+    if stop.is_set():
+        return
+    # batches with failed lookups are retried by the next run
+    progress.status("metadata", "done" if incomplete == 0 else f"{incomplete} batches incomplete")
+
+
+def CityPipeline(config):
+    """
+    Runs the whole city pipeline described by config (see DEFAULTS) into
+    config["output"]:
+        roads/       roads shapefile, when extracted from config["city"]
+        points/      sample points shapefile
+        metadata/    Pnt_start*_end*.txt metadata batches and, unless
+                     config["metadata_cache"] says otherwise, cache.sqlite
+        greenview/   GV_pipeline.txt and, with YOLO enabled, yolo_results/
+        progress.json, the export file (config["export"], None to skip)
+
+    Return:
+        dict of the final per-stage counters
+    """
+    config = {**DEFAULTS, **config}
+    output = config["output"]
+    if not output or not config["key_file"]:
+        raise ValueError("output and key_file are required")
+    os.makedirs(output, exist_ok=True)
+
+    progress = StageProgress(os.path.join(output, "progress.json"), config["progress_seconds"])
+    with progress:
+        # Roads: given shapefile, or extracted (and cached) once for the city
+        roads = config["roads"]
+        if not roads:
+            if not config["city"]:
+                raise ValueError("either roads or city is required")
+            from city_road_extration_in_shapefile import city_folder, extract_city_roads
+            roads = os.path.join(output, "roads", city_folder(config["city"]),
+                                 f"{city_folder(config['city'])}_roads.shp")
+            if not os.path.exists(roads):
+                progress.status("roads", "running")
+                roads = extract_city_roads(config["city"], os.path.join(output, "roads"),
+                                           cache_folder=config["graph_cache"])
+                if roads is None:
+                    raise RuntimeError(f"road extraction failed for {config['city']}")
+            progress.status("roads", "done")
+
+        pointQueue = queue.Queue(max(1, config["queue_size"] // 16))
+        panoQueue = queue.Queue(config["queue_size"] * 16)
+        # failed batches are redone by the next run, the cache answers their finished points
+        metadataCache = config["metadata_cache"]
+        if metadataCache is None:
+            metadataCache = os.path.join(output, "metadata", "cache.sqlite")
+        # set when a stage fails, so the others give up instead of blocking on a full queue
+        stop = threading.Event()
+        stages = [
+            _Stage(stream_points, roads, os.path.join(output, "points"), config["mini_dist"],
+                   config["batch_size"], config["segment_chunk"], progress, stop, pointQueue, stop=stop),
+            _Stage(collect_metadata, os.path.join(output, "metadata"), config["key_file"],
+                   config["metadata_url"], config["metadata_in_flight"], config["rate_per_key"],
+                   metadataCache, progress, stop, pointQueue, panoQueue, stop=stop),
+        ]
+        for stage in stages:
+            stage.start()
+
+        # Green view (and other analyzers) on the panoramas as they are found
+        from street_pipeline import StreetViewPipeline
+        greenviewFolder = os.path.join(output, "greenview")
+        panoramas = iter_queue(panoQueue, stop)
+
+        def counted(records):
+            for record in records:
+                progress.add("greenview", "panos_in")
+                yield record
+
+        processed = None
+        try:
+            processed = StreetViewPipeline(None, greenviewFolder, config["greenmonth"], config["key_file"],
+                                           analyzers=config["analyzers"], max_in_flight=config["image_in_flight"],
+                                           rate_per_key=config["rate_per_key"], base_url=config["image_url"],
+                                           image_cache_root=config["image_cache"], panoramas=counted(panoramas))
+        finally:
+            # the green view end comes after the metadata stage ended or failed;
+            # after any failure stop the stages still running before joining them
+            if processed is None or any(stage.error is not None for stage in stages):
+                stop.set()
+            for stage in stages:
+                stage.join()
+        for stage in stages:
+            if stage.error is not None:
+                raise stage.error
+        progress.add("greenview", "processed", processed)
+        progress.status("greenview", "done")
+
+        # Export once every result is in
+        if config["export"] and "greenview" in config["analyzers"]:
+            progress.status("export", "running")
+            from Greenview2Shp_final import ExportGreenViewPoints, Read_GVI_columns
+            columns = Read_GVI_columns(greenviewFolder)
+            exported = ExportGreenViewPoints(os.path.join(output, config["export"]), columns)
+            progress.add("export", "points", exported)
+            progress.status("export", "done")
+
+    return progress.snapshot()["stages"]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Street walkability pipeline for one city")
+    parser.add_argument("--config", help="JSON file with the settings below (command line wins)")
+    parser.add_argument("--city", help="place name to extract the roads of, e.g. 'Vijayawada, India'")
+    parser.add_argument("--roads", help="existing roads shapefile, instead of --city")
+    parser.add_argument("--out", dest="output", help="output folder of the run")
+    parser.add_argument("--keys", dest="key_file", help="file of Google API keys, one per line")
+    parser.add_argument("--mini-dist", type=float, help="meters between sample points")
+    parser.add_argument("--analyzers", nargs="+", choices=["greenview", "yolo"])
+    parser.add_argument("--metadata-cache", help="SQLite metadata cache file (default: metadata/cache.sqlite)")
+    parser.add_argument("--image-cache", help="image cache folder")
+    parser.add_argument("--graph-cache", help="OSM graph cache folder")
+    parser.add_argument("--export", help="export file name in the output folder (.gpkg, .fgb, .shp)")
+    parser.add_argument("--metadata-url", help="metadata endpoint, e.g. a local mock server")
+    parser.add_argument("--image-url", help="image endpoint, e.g. a local mock server")
+    return parser.parse_args(argv)
+
+
+# ------------------------------ Main function -------------------------------
+if __name__ == "__main__":
+    args = vars(parse_args())
+    config = {}
+    configPath = args.pop("config")
+    if configPath:
+        with open(configPath, "r") as f:
+            config = json.load(f)
+    config.update({k: v for k, v in args.items() if v is not None})
+    CityPipeline(config)
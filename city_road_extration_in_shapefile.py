@@ -1,18 +1,126 @@
 import os
-import osmnx as ox
+import re
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
 
-def extract_city_roads(city_name, output_base_folder):
+# osmnx network types and the matching pyrosm network types for .osm.pbf input
+PYROSM_NETWORK_TYPES = {'drive': 'driving', 'walk': 'walking', 'bike': 'cycling', 'all': 'all'}
+
+# highway values osmnx leaves out of each network type when downloading; the
+# same filter is applied to graphs read from .osm XML files, which hold every way
+_NOT_ROUTABLE = {'abandoned', 'construction', 'no', 'planned', 'platform', 'proposed', 'raceway', 'razed'}
+_MOTORWAYS = {'motorway', 'motorway_link'}
+NETWORK_EXCLUDED_HIGHWAYS = {
+    'drive': _NOT_ROUTABLE | {'bridleway', 'bus_guideway', 'corridor', 'cycleway', 'elevator', 'escalator',
+                              'footway', 'path', 'pedestrian', 'service', 'steps', 'track'},
+    'walk': _NOT_ROUTABLE | _MOTORWAYS | {'bus_guideway', 'cycleway'},
+    'bike': _NOT_ROUTABLE | _MOTORWAYS | {'bus_guideway', 'corridor', 'elevator', 'escalator', 'footway', 'steps'},
+    'all': _NOT_ROUTABLE,
+}
+
+def city_folder(city_name):
+    return city_name.split(",")[0].replace(" ", "_").lower()
+
+def graph_cache_path(cache_folder, place, network_type, source=None):
+    """
+    Cache file of the graph of a place: readable slug plus a hash of the
+    exact place string, network type and source, e.g. hyderabad_drive_1a2b3c4d5e.graphml
+    source is the local OSM extract the graph is built from (None when it is
+    downloaded); its size and modification time are part of the key, so a
+    refreshed extract gets a new cache entry.
+    """
+    ident = f"{place.strip().lower()}|{network_type}"
+    if source:
+        stat = os.stat(source)
+        ident += f"|{os.path.abspath(source)}|{stat.st_size}|{int(stat.st_mtime)}"
+    digest = hashlib.sha1(ident.encode("utf-8")).hexdigest()[:10]
+    slug = re.sub(r"[^a-z0-9_]+", "", city_folder(place))
+    return os.path.join(cache_folder, f"{slug}_{network_type}_{digest}.graphml")
+
+def graph_from_osm_file(pbf_path, network_type='drive'):
+    """
+    Builds an osmnx compatible graph from a local .osm.pbf extract (through
+    pyrosm) or an .osm XML file (through osmnx), without any network access.
+    The extract should cover the city only, e.g. clipped with osmium.
+    XML files hold every way, so their edges are filtered to network_type
+    like osmnx filters a download.
+    """
+    import osmnx as ox
+
+    if not pbf_path.endswith('.pbf'):
+        G = ox.graph_from_xml(pbf_path, simplify=False)
+        return ox.simplify_graph(filter_network_type(G, network_type))
+
+    from pyrosm import OSM
+    osm = OSM(pbf_path)
+    nodes, edges = osm.get_network(nodes=True, network_type=PYROSM_NETWORK_TYPES[network_type])
+    G = osm.to_graph(nodes, edges, graph_type="networkx")
+    return ox.simplify_graph(G)
+
+def filter_network_type(G, network_type):
+    """
+    Removes the edges whose highway tag is not part of network_type (see
+    NETWORK_EXCLUDED_HIGHWAYS) and the nodes left without edges.
+    """
+    if network_type not in NETWORK_EXCLUDED_HIGHWAYS:
+        raise ValueError(f"unsupported network type for OSM files: {network_type}")
+    excluded = NETWORK_EXCLUDED_HIGHWAYS[network_type]
+    drop = []
+    for u, v, key, highway in G.edges(keys=True, data='highway'):
+        tags = highway if isinstance(highway, list) else [highway]
+        if highway is None or any(tag in excluded for tag in tags):
+            drop.append((u, v, key))
+    G.remove_edges_from(drop)
+    G.remove_nodes_from([node for node, degree in G.degree() if degree == 0])
+    print(f"🧹 Dropped {len(drop)} edges not in the {network_type} network")
+    return G
+
+def load_city_graph(city_name, network_type='drive', cache_folder=None, pbf_path=None):
+    """
+    Returns the road graph of a city. With cache_folder the graph is read
+    from its GraphML cache file when present, otherwise it is built (from
+    pbf_path when given, else downloaded) and written to the cache.
+    """
+    import osmnx as ox
+
+    cache_path = graph_cache_path(cache_folder, city_name, network_type, pbf_path) if cache_folder else None
+    if cache_path and os.path.exists(cache_path):
+        print(f"📦 Using cached graph: {cache_path}")
+        return ox.load_graphml(cache_path)
+
+    if pbf_path:
+        G = graph_from_osm_file(pbf_path, network_type)
+    else:
+        G = ox.graph_from_place(city_name, network_type=network_type)
+
+    if cache_path:
+        os.makedirs(cache_folder, exist_ok=True)
+        # written next to the final file and renamed, so a cache file is always complete
+        tmp_path = f"{cache_path}.tmp{os.getpid()}"
+        ox.save_graphml(G, tmp_path)
+        os.replace(tmp_path, cache_path)
+    return G
+
+def extract_city_roads(city_name, output_base_folder, network_type='drive', cache_folder=None, pbf_path=None):
     """
     Downloads all driveable roads for a given city and saves them as a shapefile.
+    Returns the shapefile path, or None if the city failed.
     """
     print(f"\n🔄 Processing: {city_name}...")
-    city_folder_name = city_name.split(",")[0].replace(" ", "_").lower()
+    city_folder_name = city_folder(city_name)
     output_folder = os.path.join(output_base_folder, city_folder_name)
     os.makedirs(output_folder, exist_ok=True)
 
     try:
-        # Download driveable road network
-        G = ox.graph_from_place(city_name, network_type='drive')
+        import osmnx as ox
+
+        if cache_folder:
+            # raw Overpass answers are cached too, next to the graphs
+            ox.settings.use_cache = True
+            ox.settings.cache_folder = os.path.join(cache_folder, "http")
+
+        # Download driveable road network, or reuse the cached graph
+        G = load_city_graph(city_name, network_type, cache_folder, pbf_path)
 
         # Convert to GeoDataFrame (edges only)
         edges = ox.graph_to_gdfs(G, nodes=False, edges=True)
@@ -22,8 +130,31 @@ def extract_city_roads(city_name, output_base_folder):
         edges.to_file(shp_path)
 
         print(f"✅ Roads saved: {shp_path}")
+        return shp_path
     except Exception as e:
         print(f"❌ Failed to process {city_name}: {e}")
+        return None
+
+def extract_cities_parallel(cities, output_base_folder, workers=None, network_type='drive',
+                            cache_folder=None, pbf_paths=None):
+    """
+    Extracts the roads of several cities in parallel worker processes.
+    pbf_paths optionally maps a city name to its local .osm.pbf extract.
+    Returns {city: shapefile path or None}.
+    """
+    pbf_paths = pbf_paths or {}
+    workers = min(workers or os.cpu_count() or 1, len(cities)) or 1
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {city: pool.submit(extract_city_roads, city, output_base_folder, network_type,
+                                     cache_folder, pbf_paths.get(city))
+                   for city in cities}
+        results = {city: future.result() for city, future in futures.items()}
+
+    failed = [city for city, path in results.items() if path is None]
+    print(f"\n🏁 {len(cities) - len(failed)}/{len(cities)} cities extracted")
+    if failed:
+        print(f"❌ Failed: {', '.join(failed)}")
+    return results
 
 # ---------------- MAIN ----------------
 
@@ -39,8 +170,10 @@ if __name__ == "__main__":
     ]
 
     # Base output folder
-    output_base = "C:\Treepedia_Public-master\city_road_extration_in_shapefile\city_data"
+    output_base = r"C:\Treepedia_Public-master\city_road_extration_in_shapefile\city_data"
+
+    # Downloaded graphs are kept here, reruns do not hit the network again
+    graph_cache = r"C:\Treepedia_Public-master\city_road_extration_in_shapefile\graph_cache"
 
-    # Extract roads for each city
-    for city in cities:
-        extract_city_roads(city, output_base)
\ No newline at end of file
+    # Extract roads for all cities in parallel
+    extract_cities_parallel(cities, output_base, cache_folder=graph_cache)
\ No newline at end of file
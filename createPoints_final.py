@@ -2,125 +2,56 @@
 # Generates points along streets every mini_dist meters with attributes
 # Last updated: July 2025 by OpenAI for extended metadata traceability
 
-def createPoints(inshp, outshp, mini_dist):
-    import fiona
-    import os
-    from shapely.geometry import shape, mapping
-    from shapely.ops import transform
-    from functools import partial
-    import pyproj
-    from fiona.crs import from_epsg
-
-    # Exclude major roads, highways, footpaths
-    excluded_highways = {
-        'trunk_link', 'tertiary', 'motorway', 'motorway_link', 'steps', None, ' ',
-        'pedestrian', 'primary', 'primary_link', 'footway', 'tertiary_link',
-        'trunk', 'secondary', 'secondary_link', 'bridleway', 'service'
-    }
+from metrics import METRICS, instrument_stage
 
-    # Prepare cleaned temp shapefile path
-    root = os.path.dirname(inshp)
-    basename = 'clean_' + os.path.basename(inshp)
-    temp_cleanedStreetmap = os.path.join(root, basename)
+@instrument_stage("points")
+def createPoints(inshp, outshp, mini_dist, workers=1, partition='range', min_spacing=None):
+    """
+    Samples points every mini_dist meters along the streets of inshp and
+    writes them to the outshp point shapefile.
 
-    if os.path.exists(temp_cleanedStreetmap):
-        fiona.remove(temp_cleanedStreetmap, 'ESRI Shapefile')
+    workers > 1 samples the filtered road layer in a process pool, split into
+    chunks by feature range (partition='range') or by spatial tile
+    (partition='tile'). point_id numbering is the same in both modes.
 
-    # Clean input shapefile (remove excluded highway types)
-    with fiona.open(inshp) as source, fiona.open(
-        temp_cleanedStreetmap, 'w',
-        driver=source.driver, crs=source.crs, schema=source.schema
-    ) as dest:
-        for feat in source:
-            try:
-                highway = feat['properties']['highway']
-                if highway in excluded_highways:
-                    continue
-            except:
-                key = list(dest.schema['properties'].keys())[0]
-                val = feat['properties'][key]
-                if val in excluded_highways:
-                    continue
-            dest.write(feat)
+    min_spacing (meters) drops every sample that lies closer than that to a
+    point already kept, across all segments, so dense junctions do not turn
+    into clusters of near-identical Street View lookups.
 
-    # Define output point schema
-    schema = {
-        'geometry': 'Point',
-        'properties': {
-            'point_id': 'int',
-            'street_id': 'str',
-            'street_name': 'str'
-        },
-    }
-
-    total_points = 0
+    metrics_path, metrics_seconds and profile_path enable the JSON metrics
+    file, periodic metrics summaries and cProfile output (see metrics.py).
+    """
+    import os
+    from street_sampler import (EXCLUDED_HIGHWAYS, iter_clean_segments, sample_segments_parallel, thin_points,
+                                to_lonlat, write_points)
 
     # Create output point shapefile
     if not os.path.exists(os.path.dirname(outshp)):
         os.makedirs(os.path.dirname(outshp), exist_ok=True)
 
-    with fiona.Env():
-        with fiona.open(outshp, 'w', crs=from_epsg(4326), driver='ESRI Shapefile', schema=schema) as output:
-            for line in fiona.open(temp_cleanedStreetmap):
-                try:
-                    geom = shape(line['geometry'])
-                    length = geom.length
-
-                    street_id = line['properties'].get('osm_id', 'NA')
-                    street_name = line['properties'].get('name', 'NA')
-
-                    # Project to meters
-                    project = partial(
-                        pyproj.transform,
-                        pyproj.Proj(init='EPSG:4326'),
-                        pyproj.Proj(init='EPSG:3857')
-                    )
-                    geom_m = transform(project, geom)
-                    line_len = geom_m.length
-
-                    # Interpolate points along line
-                    if line_len < mini_dist:
-                        point = geom_m.interpolate(line_len / 2)
-                        back_proj = partial(
-                            pyproj.transform,
-                            pyproj.Proj(init='EPSG:3857'),
-                            pyproj.Proj(init='EPSG:4326')
-                        )
-                        point = transform(back_proj, point)
-                        output.write({
-                            'geometry': mapping(point),
-                            'properties': {
-                                'point_id': total_points,
-                                'street_id': str(street_id),
-                                'street_name': str(street_name)
-                            }
-                        })
-                        total_points += 1
-                    else:
-                        for distance in range(0, int(line_len), mini_dist):
-                            point = geom_m.interpolate(distance)
-                            back_proj = partial(
-                                pyproj.transform,
-                                pyproj.Proj(init='EPSG:3857'),
-                                pyproj.Proj(init='EPSG:4326')
-                            )
-                            point = transform(back_proj, point)
-                            output.write({
-                                'geometry': mapping(point),
-                                'properties': {
-                                    'point_id': total_points,
-                                    'street_id': str(street_id),
-                                    'street_name': str(street_name)
-                                }
-                            })
-                            total_points += 1
-
-                except Exception as e:
-                    print(f"[ERROR] Skipping segment due to error: {e}")
-                    continue
+    # Stream the segments that pass the highway filter straight into the
+    # sampler, no cleaned copy of the shapefile is written
+    with METRICS.timer("points.read_segments"):
+        segments = list(iter_clean_segments(inshp, EXCLUDED_HIGHWAYS))
+    METRICS.incr("points.segments", len(segments))
+
+    with METRICS.timer("points.sample"):
+        x, y, seg_idx = sample_segments_parallel(segments, mini_dist, workers, partition)
+    METRICS.incr("points.sampled", len(x))
+
+    # Optional spatial thinning of near-duplicate samples
+    if min_spacing:
+        with METRICS.timer("points.thin"):
+            keep = thin_points(x, y, min_spacing)
+        removed = len(keep) - int(keep.sum())
+        x, y, seg_idx = x[keep], y[keep], seg_idx[keep]
+        print(f"🧹 Spatial thinning ({min_spacing} m) removed {removed} of {len(keep)} points.")
+    with METRICS.timer("points.write"):
+        lon, lat = to_lonlat(x, y)
+        total_points = write_points(outshp, lon, lat, seg_idx, segments)
+    METRICS.incr("points.written", total_points)
 
     print(f"✅ Point generation complete. Total points created: {total_points}")
-    fiona.remove(temp_cleanedStreetmap, 'ESRI Shapefile')
 
 
 # ------------ Main ------------
@@ -130,5 +61,7 @@ if __name__ == "__main__":
     inshp = r'C:\Treepedia_Public-master\india_city_shapefiles\Vijayawada\roads.shp'
     outshp = r"C:\Treepedia_Public-master\india_city_shapefiles\Vijayawada\create_points"
     mini_dist = 20  # meters between points
+    workers = os.cpu_count()  # processes used to sample the road network
+    min_spacing = None  # meters, drop samples closer than this to a kept one
 
-    createPoints(inshp, outshp, mini_dist)
+    createPoints(inshp, outshp, mini_dist, workers=workers, min_spacing=min_spacing)
@@ -0,0 +1,220 @@
+# Persisted YOLO results, so object detection runs once per panorama
+# Every run appends its own numbered part files to the results folder:
+#   detection_<run>.rec        one row per detected object and heading
+#   detection_count_<run>.rec  one row per (panorama, class) with its count
+#   detection_pano_<run>.rec   one row per finished panorama
+# A panorama is finished once its detection_pano row is on disk; rows of the
+# other files only count for the panoramas finished in the same run, so an
+# interrupted run never leaves duplicated or partial results behind.
+
+import csv
+import os
+import re
+from collections import defaultdict
+
+import numpy as np
+
+from pipeline_records import RecordReader, RecordWriter, iter_records
+
+KINDS = ("detection", "detection_count", "detection_pano")
+_PART_RE = re.compile(r"^(detection(?:_count|_pano)?)_(\d+)\.rec$")
+
+
+def _parts(folder):
+    """Returns {run: {kind: path}} of the part files of a results folder."""
+    runs = defaultdict(dict)
+    if os.path.isdir(folder):
+        for name in os.listdir(folder):
+            match = _PART_RE.match(name)
+            if match:
+                runs[int(match.group(2))][match.group(1)] = os.path.join(folder, name)
+    return dict(sorted(runs.items()))
+
+
+def _read_columns(path):
+    with RecordReader(path) as reader:
+        chunks = list(reader.iter_chunks())
+    if not chunks:
+        return None
+    return {name: np.concatenate([chunk[name] for chunk in chunks]) for name in chunks[0]}
+
+
+def iter_results(folder, kind):
+    """
+    Yields the columns of kind, one dict of arrays per run, restricted to
+    the panoramas finished in that run.
+    """
+    for parts in _parts(folder).values():
+        if "detection_pano" not in parts or kind not in parts:
+            continue
+        panos = _read_columns(parts["detection_pano"])
+        columns = _read_columns(parts[kind])
+        if panos is None or columns is None:
+            continue
+        if kind != "detection_pano":
+            keep = np.isin(columns["panoID"], panos["panoID"])
+            columns = {name: values[keep] for name, values in columns.items()}
+        yield columns
+
+
+def read_results(folder, kind):
+    """All finished results of kind as one dict of column arrays (or None)."""
+    runs = list(iter_results(folder, kind))
+    if not runs:
+        return None
+    return {name: np.concatenate([run[name] for run in runs]) for name in runs[0]}
+
+
+class DetectionStore:
+    """
+    Incremental, columnar writer of YOLO results.
+
+    Parameters:
+        folder: the results folder, created if needed
+        chunk_rows: rows buffered per column chunk
+    """
+
+    def __init__(self, folder, chunk_rows=10000):
+        os.makedirs(folder, exist_ok=True)
+        self.folder = folder
+        self.chunk_rows = chunk_rows
+        runs = _parts(folder)
+        self.run = max(runs) + 1 if runs else 0
+        self.done = set()
+        for columns in iter_results(folder, "detection_pano"):
+            self.done.update(columns["panoID"].tolist())
+        self.writers = None
+        self.buffered = 0
+
+    def __contains__(self, panoID):
+        return panoID in self.done
+
+    def _open(self):
+        self.writers = {
+            # flushed together by flush(), see there
+            kind: RecordWriter(os.path.join(self.folder, f"{kind}_{self.run:04d}.rec"), kind, None)
+            for kind in KINDS
+        }
+
+    def add(self, pano, headings, detections, names):
+        """
+        Stores the results of one panorama.
+
+        Parameters:
+            pano: dict with panoID, panoDate, lat, lon and greenview
+            headings: heading of every image passed to the detector
+            detections: DETECTION_DTYPE array, image indexes into headings
+            names: class id -> class name of the model
+        """
+        if self.writers is None:
+            self._open()
+        panoID = pano["panoID"]
+        n = len(detections)
+        labels = [names.get(int(c), str(int(c))) for c in detections["cls"]]
+        for d, name in zip(detections.tolist(), labels):
+            image, cls, conf, x1, y1, x2, y2 = d
+            self.writers["detection"].write({
+                "panoID": panoID, "heading": float(headings[image]), "cls": cls, "name": name,
+                "conf": conf, "x1": x1, "y1": y1, "x2": x2, "y2": y2,
+            })
+        if n:
+            classes, counts = np.unique(labels, return_counts=True)
+            for name, count in zip(classes.tolist(), counts.tolist()):
+                self.writers["detection_count"].write({"panoID": panoID, "name": name, "count": count})
+        self.writers["detection_pano"].write({
+            "panoID": panoID, "panoDate": pano["panoDate"], "lat": pano["lat"], "lon": pano["lon"],
+            "greenview": pano["greenview"], "images": len(headings), "detections": n,
+        })
+        self.done.add(panoID)
+        self.buffered += n + 1
+        if self.buffered >= self.chunk_rows:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes the buffered rows. The finished panoramas go last, so a crash
+        in between leaves their detections unreferenced instead of lost.
+        """
+        if self.writers is not None:
+            for kind in KINDS:
+                self.writers[kind].flush()
+            self.buffered = 0
+
+    def close(self):
+        if self.writers is not None:
+            for kind in KINDS:
+                self.writers[kind].close()
+            self.writers = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _street_of_panos(metadataPath):
+    """panoID -> set of (street_id, street_name) of the points it serves."""
+    streets = defaultdict(set)
+    if metadataPath.endswith(".csv"):
+        # pano_point_map.csv written by DedupPanoMetadata
+        with open(metadataPath, "r", newline="", encoding="utf-8") as f:
+            records = list(csv.DictReader(f))
+    else:
+        records = iter_records(metadataPath)
+    for record in records:
+        street_id = str(record.get("street_id", "None"))
+        if street_id != "None":
+            streets[record["panoID"]].add((street_id, str(record.get("street_name", "None"))))
+    return streets
+
+
+def AggregateDetectionsByStreet(resultsFolder, metadataPath, outputCsv):
+    """
+    Aggregates the stored panorama results to streets.
+
+    Parameters:
+        resultsFolder: folder of a DetectionStore
+        metadataPath: the collector's metadata folder/file, or the
+                      pano_point_map.csv of DedupPanoMetadata
+        outputCsv: one row per street_id with the number of panoramas, the
+                   mean green view and the total count of every class
+
+    Return:
+        number of streets written
+    """
+    panos = read_results(resultsFolder, "detection_pano")
+    if panos is None:
+        print('[ERROR] No stored detections found.')
+        return 0
+    streetsOfPano = _street_of_panos(metadataPath)
+
+    counts = defaultdict(dict)
+    countColumns = read_results(resultsFolder, "detection_count")
+    if countColumns is not None:
+        for panoID, name, count in zip(countColumns["panoID"].tolist(), countColumns["name"].tolist(),
+                                       countColumns["count"].tolist()):
+            counts[panoID][name] = counts[panoID].get(name, 0) + count
+    classNames = sorted({name for panoCounts in counts.values() for name in panoCounts})
+
+    # a panorama shared by several points of a street is counted once for it
+    streets = {}
+    for panoID, greenview in zip(panos["panoID"].tolist(), panos["greenview"].tolist()):
+        for street in streetsOfPano.get(panoID, ()):
+            street = streets.setdefault(street, {"panos": 0, "greenview": [], "counts": defaultdict(int)})
+            street["panos"] += 1
+            if greenview >= 0:
+                street["greenview"].append(greenview)
+            for name, count in counts.get(panoID, {}).items():
+                street["counts"][name] += count
+
+    with open(outputCsv, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["street_id", "street_name", "panos", "greenview"] + classNames)
+        for (street_id, street_name), street in sorted(streets.items()):
+            greenview = f"{np.mean(street['greenview']):.2f}" if street["greenview"] else ""
+            writer.writerow([street_id, street_name, street["panos"], greenview]
+                            + [street["counts"].get(name, 0) for name in classNames])
+
+    print(f"[INFO] {len(panos['panoID'])} panoramas aggregated to {len(streets)} streets")
+    return len(streets)
@@ -0,0 +1,165 @@
+# Shared HTTP helpers for the Google Street View API stages
+# Pooled per-thread sessions and per-key token bucket rate limiting, so the
+# collectors can keep many requests in flight without fixed sleeps.
+
+import threading
+import time
+from collections import deque
+
+from metrics import METRICS, key_label
+
+METADATA_URL = "https://maps.googleapis.com/maps/api/streetview/metadata"
+IMAGE_URL = "https://maps.googleapis.com/maps/api/streetview"
+
+
+def load_keys(key_file):
+    """Reads the API keys of key_file, one per line, skipping blank lines."""
+    with open(key_file, "r") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+class TokenBucket:
+    """
+    Classic token bucket: rate tokens per second, holding at most capacity.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(rate, 1))
+        self.tokens = self.capacity
+        self.stamp = time.monotonic()
+
+    def try_acquire(self):
+        """
+        Takes one token if available. Returns 0 on success, otherwise the
+        number of seconds until the next token is due.
+        """
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class KeyPool:
+    """
+    Hands out API keys round-robin, each key limited by its own token bucket.
+    acquire() blocks until some key has a token. Thread safe.
+    """
+
+    def __init__(self, keys, rate_per_key=10, burst=None):
+        if not keys:
+            raise ValueError("no API keys given")
+        self.keys = list(keys)
+        self.buckets = [TokenBucket(rate_per_key, burst) for _ in self.keys]
+        self.next = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                waits = []
+                for step in range(len(self.keys)):
+                    k = (self.next + step) % len(self.keys)
+                    wait = self.buckets[k].try_acquire()
+                    if wait == 0:
+                        self.next = (k + 1) % len(self.keys)
+                        return self.keys[k]
+                    waits.append(wait)
+            time.sleep(min(waits))
+
+
+_local = threading.local()
+
+
+def get_session(pool_size=16):
+    """
+    Returns the requests Session of the calling thread, so connections are
+    kept alive and reused across calls without sharing a session between threads.
+    """
+    session = getattr(_local, "session", None)
+    if session is None:
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        _local.session = session
+    return session
+
+
+def fetch_metadata(lat, lon, key_pool, base_url=METADATA_URL, timeout=30):
+    """
+    Queries the Street View metadata endpoint for a location.
+    Returns the decoded JSON answer.
+    """
+    key = key_pool.acquire()
+    params = {"location": f"{lat},{lon}", "key": key}
+    METRICS.incr(f"api.metadata.requests[{key_label(key)}]")
+    start = time.perf_counter()
+    try:
+        response = get_session().get(base_url, params=params, timeout=timeout)
+        response.raise_for_status()
+        result = response.json()
+    except Exception:
+        METRICS.incr(f"api.metadata.errors[{key_label(key)}]")
+        raise
+    finally:
+        METRICS.observe("api.metadata.latency", time.perf_counter() - start)
+    METRICS.incr(f"api.metadata.status.{result.get('status')}")
+    return result
+
+
+def fetch_image(panoID, heading, key_pool, pitch=0, fov=60, size="400x400",
+                base_url=IMAGE_URL, retries=3, backoff=1.0, timeout=30):
+    """
+    Downloads one Street View image of a panorama and returns its bytes.
+    Connection errors, 429 and 5xx answers are retried with exponential
+    backoff; other HTTP errors are raised immediately.
+    """
+    import requests
+
+    params = {"size": size, "pano": panoID, "fov": fov, "heading": heading, "pitch": pitch}
+    for attempt in range(retries + 1):
+        params["key"] = key_pool.acquire()
+        label = key_label(params["key"])
+        METRICS.incr(f"api.image.requests[{label}]")
+        start = time.perf_counter()
+        try:
+            response = get_session().get(base_url, params=params, timeout=timeout)
+            METRICS.observe("api.image.latency", time.perf_counter() - start)
+            if response.status_code == 200:
+                METRICS.incr("api.image.bytes", len(response.content))
+                return response.content
+            METRICS.incr(f"api.image.errors[{label}]")
+            if response.status_code != 429 and response.status_code < 500:
+                response.raise_for_status()
+            error = requests.HTTPError(f"status {response.status_code}", response=response)
+        except requests.HTTPError:
+            raise
+        except requests.RequestException as e:
+            METRICS.incr(f"api.image.errors[{label}]")
+            error = e
+        if attempt < retries:
+            METRICS.incr("api.image.retries")
+            time.sleep(backoff * 2 ** attempt)
+    raise error
+
+
+def bounded_map(executor, fn, items, window):
+    """
+    Like executor.map, but keeps at most window tasks submitted ahead of the
+    consumer, so memory stays flat however many items there are. Results are
+    yielded in input order.
+    """
+    pending = deque()
+    for item in items:
+        pending.append(executor.submit(fn, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
@@ -0,0 +1,127 @@
+# Content-addressed on-disk store for Street View images
+# Images are keyed by (panoID, heading, pitch, fov, size) and kept in sharded
+# folders so classifiers can be rerun at disk speed, optionally fully offline.
+
+import hashlib
+import os
+import threading
+
+from metrics import METRICS
+
+
+class CacheMiss(LookupError):
+    """Raised when an image is not cached and the cache is offline."""
+
+
+class ImageCache:
+    """
+    Sharded image store with an optional size cap.
+
+    Parameters:
+        root: folder of the store, images live in root/ab/cd/<sha1>.jpg
+        max_bytes: optional size cap, the least recently used images are
+                   evicted once it is exceeded
+        offline: never touch the network, a miss raises CacheMiss
+    """
+
+    def __init__(self, root, max_bytes=None, offline=False):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        self.total_bytes = sum(size for _, size, _ in self._files()) if max_bytes else 0
+
+    @staticmethod
+    def key(panoID, heading, pitch=0, fov=60, size="400x400"):
+        ident = f"{panoID}|{float(heading):g}|{float(pitch):g}|{float(fov):g}|{size}"
+        return hashlib.sha1(ident.encode("utf-8")).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.root, key[:2], key[2:4], key + ".jpg")
+
+    def _files(self):
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                if name.endswith(".jpg"):
+                    full = os.path.join(dirpath, name)
+                    try:
+                        st = os.stat(full)
+                    except OSError:
+                        continue
+                    yield full, st.st_size, st.st_mtime
+
+    def get(self, panoID, heading, pitch=0, fov=60, size="400x400"):
+        """Returns the cached image bytes, or None on a miss."""
+        path = self.path(self.key(panoID, heading, pitch, fov, size))
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            with self.lock:
+                self.misses += 1
+            METRICS.incr("image_cache.misses")
+            return None
+        # the modification time doubles as the last access time for LRU eviction
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        with self.lock:
+            self.hits += 1
+        METRICS.incr("image_cache.hits")
+        METRICS.incr("image_cache.bytes_read", len(data))
+        return data
+
+    def put(self, panoID, heading, data, pitch=0, fov=60, size="400x400"):
+        """Stores image bytes, written atomically through a temporary file."""
+        path = self.path(self.key(panoID, heading, pitch, fov, size))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp{os.getpid()}.{threading.get_ident()}"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        if self.max_bytes:
+            with self.lock:
+                self.total_bytes += len(data)
+                over = self.total_bytes > self.max_bytes
+            if over:
+                self.evict()
+
+    def evict(self):
+        """Deletes least recently used images until the store is at 90% of its cap."""
+        with self.lock:
+            files = sorted(self._files(), key=lambda item: item[2])
+            total = sum(size for _, size, _ in files)
+            target = self.max_bytes * 0.9
+            for path, size, _ in files:
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    pass
+            self.total_bytes = total
+
+    def fetch(self, panoID, heading, key_pool, pitch=0, fov=60, size="400x400", **kwargs):
+        """
+        Returns the image bytes from the store, downloading and storing them
+        on a miss unless the cache is offline.
+        """
+        data = self.get(panoID, heading, pitch, fov, size)
+        if data is not None:
+            return data
+        if self.offline:
+            raise CacheMiss(f"{panoID} heading {heading} not cached")
+        from gsv_api import fetch_image
+        data = fetch_image(panoID, heading, key_pool, pitch=pitch, fov=fov, size=size, **kwargs)
+        self.put(panoID, heading, data, pitch, fov, size)
+        return data
+
+    def stats(self):
+        total = self.hits + self.misses
+        rate = self.hits / total * 100 if total else 0.0
+        return f"image cache hits: {self.hits}, misses: {self.misses} ({rate:.1f}% hit rate)"
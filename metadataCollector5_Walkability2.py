@@ -1,29 +1,183 @@
 import os
 import time
-import json
-import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 from osgeo import ogr, osr
+from gsv_api import KeyPool, METADATA_URL, fetch_metadata, load_keys
+from metadata_cache import MetadataCache
+from checkpoint import PointCheckpoint
+from pipeline_records import format_line
+from metrics import METRICS, instrument_stage
 
-def safe_get_field(feature, field_name):
-    """Returns the field value if it exists, else 'None'."""
+# attribute names looked up for each output column, in order of preference
+POINT_FIELDS = {
+    "point_id": ("id", "point_id"),
+    "street_id": ("osm_id", "street_id"),
+    "street_name": ("name", "street_name"),
+}
+
+
+def read_point_layer(layer, transform=None):
+    """
+    Reads a whole point layer in one sequential pass.
+
+    Features are streamed in layer order (no random GetFeature lookups, FIDs
+    need not be contiguous) and their coordinates are reprojected to WGS84 in
+    a single vectorized call.
+
+    Return:
+        lon, lat: NumPy arrays of the point coordinates
+        fields: dict of point_id/street_id/street_name value lists, "None"
+                where the layer has no such attribute
+    """
+    layer_defn = layer.GetLayerDefn()
+    names = [layer_defn.GetFieldDefn(i).GetName() for i in range(layer_defn.GetFieldCount())]
+    columns = {}
+    for column, candidates in POINT_FIELDS.items():
+        columns[column] = next((names.index(c) for c in candidates if c in names), None)
+
+    xs, ys = [], []
+    fields = {column: [] for column in POINT_FIELDS}
+    layer.ResetReading()
+    for feature in layer:
+        geom = feature.GetGeometryRef()
+        if geom is None:
+            continue
+        xs.append(geom.GetX())
+        ys.append(geom.GetY())
+        for column, idx in columns.items():
+            fields[column].append(feature.GetField(idx) if idx is not None else "None")
+
+    lon = np.asarray(xs, dtype='float64')
+    lat = np.asarray(ys, dtype='float64')
+    if transform is not None and len(lon):
+        coords = np.asarray(transform.TransformPoints(np.column_stack((lon, lat)).tolist()))
+        lon, lat = coords[:, 0], coords[:, 1]
+    return lon, lat, fields
+
+class GroupCommitWriter:
+    """
+    Buffered, group-committed writer for a metadata text file.
+
+    Lines are kept in memory and written out together once group_size points
+    have been processed or group_seconds have passed. Each commit is fsynced
+    and then reported through on_commit(indices, offset), indices being the
+    points completed by the group and offset the committed file size, so the
+    checkpoint always matches what is on disk. A crash loses at most the
+    current uncommitted group.
+    """
+
+    def __init__(self, path, on_commit=None, group_size=200, group_seconds=5.0):
+        self.file = open(path, "a+", encoding='utf-8')
+        self.file.seek(0, os.SEEK_END)
+        self.on_commit = on_commit
+        self.group_size = group_size
+        self.group_seconds = group_seconds
+        self.buffer = []
+        self.uncommitted = 0
+        self.indices = []
+        self.last_commit = time.monotonic()
+
+    def advance(self, index=None, line=None):
+        """
+        Records a processed point and the line it produced, if any. index is
+        None for points that failed and must not be marked done.
+        """
+        if line is not None:
+            self.buffer.append(line)
+        if index is not None:
+            self.indices.append(index)
+        self.uncommitted += 1
+        if (self.uncommitted >= self.group_size
+                or time.monotonic() - self.last_commit >= self.group_seconds):
+            self.commit()
+
+    def commit(self):
+        if self.uncommitted == 0:
+            return False
+        with METRICS.timer("metadata.commit"):
+            if self.buffer:
+                self.file.write("".join(self.buffer))
+                self.buffer = []
+            self.file.flush()
+            os.fsync(self.file.fileno())
+        if self.on_commit is not None:
+            self.on_commit(self.indices, self.file.tell())
+        self.indices = []
+        self.uncommitted = 0
+        self.last_commit = time.monotonic()
+        return True
+
+    def close(self):
+        self.commit()
+        self.file.close()
+
+
+def lookup_point(point, key_pool, base_url, cache=None):
+    """
+    Runs the metadata query of one point, answering from the cache when
+    possible. Returns (point, result), result being None when the request failed.
+    """
+    with METRICS.timer("metadata.lookup"):
+        return _lookup_point(point, key_pool, base_url, cache)
+
+
+def _lookup_point(point, key_pool, base_url, cache):
+    lat, lon, point_id = point[0], point[1], point[2]
+    if cache is not None:
+        result = cache.get(lat, lon)
+        if result is not None:
+            return point, result
     try:
-        return feature.GetField(field_name)
-    except:
-        return "None"
+        result = fetch_metadata(lat, lon, key_pool, base_url)
+        if cache is not None:
+            cache.put(lat, lon, result)
+        return point, result
+    except Exception as e:
+        print(f"❌ API Error at point_id {point_id}: {e}")
+        return point, None
+
 
-def GSVpanoMetadataCollector(samplesFeatureClass, num, outputTextFolder, key_file):
+@instrument_stage("metadata")
+def GSVpanoMetadataCollector(samplesFeatureClass, num, outputTextFolder, key_file,
+                             max_in_flight=16, rate_per_key=10, base_url=METADATA_URL,
+                             cache_path=None, cache_precision=6, cache_ttl=None,
+                             group_size=200, group_seconds=5.0, progress_seconds=10.0,
+                             point_range=None):
     """
     Collects metadata of Google Street View Panoramas from sample points shapefile.
     Rotates through multiple API keys from a .txt file.
+
+    Up to max_in_flight requests run concurrently over pooled keep-alive
+    connections, each API key limited to rate_per_key requests per second.
+    base_url can point to a local mock metadata server for testing.
+
+    cache_path enables a persistent SQLite cache (shared across runs and
+    cities) keyed by lat/lon rounded to cache_precision decimals, entries
+    older than cache_ttl seconds are refetched.
+
+    Output lines are committed in groups of group_size points or every
+    group_seconds, each commit fsynced together with the checkpoint. Progress
+    is printed every progress_seconds.
+
+    Completed points are tracked in a checkpoint_<start>_<end>.json bitmap in
+    outputTextFolder, so a rerun resumes at point granularity and retries
+    points whose request failed. point_range=(start, end) restricts the run to
+    a range of feature indices, several processes can work on disjoint ranges
+    of the same layer at the same time.
+
+    metrics_path, metrics_seconds and profile_path enable the JSON metrics
+    file, periodic metrics summaries and cProfile output (see metrics.py).
     """
 
     # ✅ Load all API keys
-    with open(key_file, "r") as f:
-        keylist = [line.strip() for line in f if line.strip()]
+    keylist = load_keys(key_file)
     if not keylist:
         print("❌ No API keys found.")
         return
     print(f"✅ Loaded {len(keylist)} API keys.")
+    key_pool = KeyPool(keylist, rate_per_key)
+    cache = MetadataCache(cache_path, cache_precision, cache_ttl) if cache_path else None
 
     # ✅ Set driver and open shapefile
     driver = ogr.GetDriverByName('ESRI Shapefile')
@@ -45,108 +199,120 @@ def GSVpanoMetadataCollector(samplesFeatureClass, num, outputTextFolder, key_fil
     wgs84 = osr.SpatialReference()
     wgs84.ImportFromEPSG(4326)
 
+    if hasattr(osr, "OAMS_TRADITIONAL_GIS_ORDER"):
+        # keep lon/lat axis order with GDAL 3
+        wgs84.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+
     if spatialRef.IsSame(wgs84):
-        transform_needed = False
+        transform = None
         print("✅ Projection is WGS84. No transformation needed.")
     else:
-        transform_needed = True
         transform = osr.CoordinateTransformation(spatialRef, wgs84)
         print("🔁 Coordinate transformation will be applied.")
 
+    # ✅ Read all points in one sequential pass
+    with METRICS.timer("metadata.read_points"):
+        lons, lats, fields = read_point_layer(layer, transform)
+    point_ids = fields["point_id"]
+    street_ids = fields["street_id"]
+    street_names = fields["street_name"]
+
     # ✅ Batch processing
     batch_size = 1000
-    total_features = layer.GetFeatureCount()
+    total_features = len(lons)
     total_batches = (total_features // batch_size) + 1
     print(f"📍 Total points: {total_features} | Batch size: {batch_size} | Total batches: {total_batches}")
 
-    # ✅ Resume logic
+    # ✅ Point range handled by this process
+    range_start, range_end = point_range if point_range else (0, total_features)
+    range_end = min(range_end, total_features)
+
+    # ✅ Resume logic: bitmap of completed points, legacy log is imported once
+    checkpoint = PointCheckpoint(outputTextFolder, range_start, range_end)
     log_path = os.path.join(outputTextFolder, "resume_status.log")
-    resume_index = 0
-    resume_file = None
-    if os.path.exists(log_path):
-        with open(log_path, "r") as f:
-            line = f.read().strip()
-            if line:
-                resume_file, resume_index = line.split(",")
-                resume_index = int(resume_index)
-                print(f"🔁 Resuming from: {resume_file} after {resume_index} panoIDs")
+    if not os.path.exists(checkpoint.path) and os.path.exists(log_path):
+        checkpoint.import_resume_log(log_path)
+    done_before = checkpoint.count_done()
+    if done_before:
+        print(f"🔁 Resuming: {done_before} of {range_end - range_start} points already done")
 
     # ✅ Loop through batches
+    executor = ThreadPoolExecutor(max_workers=max_in_flight)
     for batch_idx in range(total_batches):
-        start = batch_idx * batch_size
-        end = min((batch_idx + 1) * batch_size, total_features)
+        start = max(batch_idx * batch_size, range_start)
+        end = min((batch_idx + 1) * batch_size, total_features, range_end)
+        if start >= end:
+            continue
         filename = f"Pnt_start{start}_end{end}.txt"
         output_path = os.path.join(outputTextFolder, filename)
 
-        if resume_file and filename < resume_file:
+        pending = [i for i in range(start, end) if not checkpoint.is_done(i)]
+        if not pending:
             print(f"⏭️ Skipping completed file: {filename}")
             continue
 
-        # ✅ Open file for writing/appending
-        panoInfoText = open(output_path, "a+", encoding='utf-8')
-        panoInfoText.seek(0, os.SEEK_END)
+        # ✅ Points of this batch
+        points = [
+            (float(lats[i]), float(lons[i]), point_ids[i], street_ids[i], street_names[i], i)
+            for i in pending
+        ]
+
+        # ✅ Drop lines written after the last committed group of a crashed run
+        if os.path.exists(output_path):
+            with open(output_path, "r+b") as f:
+                f.truncate(checkpoint.offset(filename) or 0)
+
+        # ✅ Group-committed writer, every commit is recorded in the checkpoint
+        def commit_group(indices, offset, filename=filename):
+            checkpoint.commit(indices, filename, offset)
+
+        writer = GroupCommitWriter(output_path, commit_group, group_size, group_seconds)
         written_count = 0
+        no_pano = 0
+        failed = 0
+        batch_start = time.monotonic()
+        last_report = batch_start
+
+        # ✅ Query concurrently, results come back in point order
+        results = executor.map(lambda pnt: lookup_point(pnt, key_pool, base_url, cache), points)
+        for (lat, lon, point_id, street_id, street_name, i), result in results:
+            line = None
+            status = result.get("status") if result is not None else None
+            METRICS.incr("metadata.points")
+            if status in ("ZERO_RESULTS", "NOT_FOUND"):
+                no_pano += 1
+                METRICS.incr("metadata.no_pano")
+            elif status != "OK":
+                # request failed or quota/denied answer, retried on the next run
+                failed += 1
+                METRICS.incr("metadata.failed")
+                i = None
+            else:
+                METRICS.incr("metadata.panos")
+                line = format_line("metadata", {
+                    "panoID": result.get("pano_id"), "panoDate": result.get("date", "None"),
+                    "lat": lat, "lon": lon, "street_id": street_id,
+                    "street_name": street_name if street_name else "None", "point_id": point_id,
+                })
+                written_count += 1
+            writer.advance(i, line)
+
+            # ✅ Periodic progress summary instead of per-point output
+            now = time.monotonic()
+            if now - last_report >= progress_seconds:
+                done = written_count + no_pano + failed
+                print(f"📈 {filename}: {done}/{len(points)} points | panos {written_count} | "
+                      f"no GSV {no_pano} | errors {failed} | {done / (now - batch_start):.1f} pts/s")
+                last_report = now
+
+        writer.close()
+        print(f"✅ Finished file: {filename} and saved {written_count} panoIDs "
+              f"({no_pano} without GSV, {failed} errors).\n")
 
-        for i in range(start, end):
-            if resume_file == filename and i < resume_index:
-                continue
-
-            feature = layer.GetFeature(i)
-            if not feature:
-                continue
-            geom = feature.GetGeometryRef()
-            if transform_needed:
-                geom.Transform(transform)
-            lon = geom.GetX()
-            lat = geom.GetY()
-
-            # Use safe field retrieval
-            point_id = safe_get_field(feature, "id")
-            street_id = safe_get_field(feature, "osm_id")
-            street_name = safe_get_field(feature, "name")
-
-            key = keylist[i % len(keylist)]
-            url = f"https://maps.googleapis.com/maps/api/streetview/metadata?location={lat},{lon}&key={key}"
-
-            try:
-                with urllib.request.urlopen(url) as response:
-                    result = json.loads(response.read().decode())
-
-                if result.get("status") == "OK":
-                    panoID = result.get("pano_id")
-                    panoDate = result.get("date", "None")
-                    street_name_str = street_name if street_name else "None"
-
-                    line = f"panoID: {panoID}  panoDate: {panoDate}  lat: {lat}  lon: {lon}  street_id: {street_id}  street_name: {street_name_str}  point_id: {point_id}\n"
-
-                    try:
-                        panoInfoText.write(line)
-                        panoInfoText.flush()
-                        os.fsync(panoInfoText.fileno())
-                        written_count += 1
-                        print(f"✅ {point_id}: panoID {panoID}, lat {lat}, lon {lon}")
-                        print(f"📄 Written to file: {line.strip()}")
-                    except Exception as write_err:
-                        print(f"❌ Failed to write line at point_id {point_id}: {write_err}")
-                        continue
-                else:
-                    print(f"⚠️ No GSV data at point_id {point_id}: {result.get('status')}")
-
-                time.sleep(0.1)
-
-            except Exception as e:
-                print(f"❌ API Error at point_id {point_id}: {e}")
-                time.sleep(1)
-                continue
-
-        panoInfoText.flush()
-        os.fsync(panoInfoText.fileno())
-        panoInfoText.close()
-
-        # ✅ Log resume info
-        with open(log_path, "w") as f:
-            f.write(f"{filename},{end - 1}")
-        print(f"✅ Finished file: {filename} and saved {written_count} panoIDs.\n")
+    executor.shutdown()
+    if cache is not None:
+        print(f"🗄️ Metadata {cache.stats()}")
+        cache.close()
 
 
 # ✅ Example usage (edit paths as needed)
@@ -154,4 +320,6 @@ if __name__ == "__main__":
     shapefile_path = r"C:\Treepedia_Public-master\india_city_shapefiles\Nellore\create_points\create_points.shp"
     output_folder = r"C:\Treepedia_Public-master\india_city_shapefiles\Nellore\metadata"
     key_file_path = r"C:\Treepedia_Public-master\Treepedia\keys1.txt"
-    GSVpanoMetadataCollector(shapefile_path, num=116932, outputTextFolder=output_folder, key_file=key_file_path)
+    cache_path = r"C:\Treepedia_Public-master\gsv_metadata_cache.sqlite"
+    GSVpanoMetadataCollector(shapefile_path, num=116932, outputTextFolder=output_folder, key_file=key_file_path,
+                             cache_path=cache_path)
@@ -0,0 +1,96 @@
+# Persistent location -> panorama metadata cache
+# SQLite store shared across collector runs and cities, keyed by the rounded
+# lat/lon of the query so regenerated or overlapping sample points are
+# resolved without another Street View metadata call.
+
+import sqlite3
+import threading
+import time
+
+from metrics import METRICS
+
+# answers worth keeping, anything else (quota, denied, errors) is retried
+CACHEABLE_STATUS = ("OK", "ZERO_RESULTS")
+
+
+class MetadataCache:
+    """
+    On-disk cache of Street View metadata answers.
+
+    Parameters:
+        path: SQLite database file, created if missing
+        precision: number of decimals lat/lon are rounded to for the key
+                   (6 decimals is about 0.1 m)
+        ttl: optional maximum age of an entry in seconds
+    """
+
+    def __init__(self, path, precision=6, ttl=None, commit_every=100):
+        self.path = path
+        self.precision = precision
+        self.ttl = ttl
+        self.commit_every = commit_every
+        self.hits = 0
+        self.misses = 0
+        self.pending = 0
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS metadata ("
+            " lat_key INTEGER, lon_key INTEGER, precision INTEGER,"
+            " status TEXT, pano_id TEXT, date TEXT, fetched_at REAL,"
+            " PRIMARY KEY (lat_key, lon_key, precision))"
+        )
+        self.conn.commit()
+
+    def _key(self, lat, lon):
+        scale = 10 ** self.precision
+        return int(round(float(lat) * scale)), int(round(float(lon) * scale)), self.precision
+
+    def get(self, lat, lon):
+        """Returns the cached answer as a metadata dict, or None on a miss."""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT status, pano_id, date, fetched_at FROM metadata"
+                " WHERE lat_key = ? AND lon_key = ? AND precision = ?",
+                self._key(lat, lon)
+            ).fetchone()
+            if row is None or (self.ttl is not None and time.time() - row[3] > self.ttl):
+                self.misses += 1
+                METRICS.incr("metadata_cache.misses")
+                return None
+            self.hits += 1
+        METRICS.incr("metadata_cache.hits")
+
+        status, pano_id, date, _ = row
+        result = {"status": status}
+        if pano_id is not None:
+            result["pano_id"] = pano_id
+        if date is not None:
+            result["date"] = date
+        return result
+
+    def put(self, lat, lon, result):
+        """Stores an OK or ZERO_RESULTS answer, other statuses are ignored."""
+        status = result.get("status")
+        if status not in CACHEABLE_STATUS:
+            return
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO metadata VALUES (?, ?, ?, ?, ?, ?, ?)",
+                self._key(lat, lon) + (status, result.get("pano_id"), result.get("date"), time.time())
+            )
+            self.pending += 1
+            if self.pending >= self.commit_every:
+                self.conn.commit()
+                self.pending = 0
+
+    def stats(self):
+        total = self.hits + self.misses
+        rate = self.hits / total * 100 if total else 0.0
+        return f"cache hits: {self.hits}, misses: {self.misses} ({rate:.1f}% hit rate)"
+
+    def close(self):
+        with self.lock:
+            self.conn.commit()
+            self.conn.close()
@@ -0,0 +1,241 @@
+# Throughput and latency instrumentation shared by the pipeline stages
+# Counters, timers and latency histograms live in one process wide registry
+# (METRICS). instrumented() wraps a stage run: it prints a structured summary
+# every few seconds, writes the final numbers to a JSON file and can profile
+# the run with cProfile. Without a metrics file or profile nothing is written,
+# the counters themselves cost a lock and a dict update.
+
+import bisect
+import cProfile
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from checkpoint import atomic_write
+
+# latency bucket upper bounds in seconds, the last bucket is open ended
+BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0)
+
+# environment fallbacks, so the scripts with hard-coded main blocks can be
+# instrumented without editing them: folders for <stage>_metrics.json / .prof
+METRICS_DIR_ENV = "WALKABILITY_METRICS_DIR"
+PROFILE_DIR_ENV = "WALKABILITY_PROFILE_DIR"
+
+
+class Histogram:
+    """Fixed bucket latency histogram with count, sum, min and max."""
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q quantile."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS + (self.max,), self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def merge(self, state):
+        for n, count in enumerate(state["buckets"]):
+            self.counts[n] += count
+        self.count += state["count"]
+        self.total += state["sum"]
+        for name, pick in (("min", min), ("max", max)):
+            if state[name] is not None:
+                mine = getattr(self, name)
+                setattr(self, name, state[name] if mine is None else pick(mine, state[name]))
+
+    def to_dict(self):
+        return {
+            "count": self.count, "sum": round(self.total, 6),
+            "mean": round(self.total / self.count, 6) if self.count else None,
+            "min": self.min, "max": self.max,
+            "p50": self.quantile(0.5), "p90": self.quantile(0.9), "p99": self.quantile(0.99),
+            "buckets": list(self.counts),
+        }
+
+
+class Metrics:
+    """
+    Thread safe registry of counters and histograms. Every update is also
+    recorded in the open scopes (see scope()), which share the lock.
+    """
+
+    def __init__(self, lock=None):
+        self.lock = lock or threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.scopes = []
+
+    def incr(self, name, amount=1):
+        with self.lock:
+            for registry in (self, *self.scopes):
+                registry.counters[name] = registry.counters.get(name, 0) + amount
+
+    def observe(self, name, value):
+        with self.lock:
+            for registry in (self, *self.scopes):
+                histogram = registry.histograms.get(name)
+                if histogram is None:
+                    histogram = registry.histograms[name] = Histogram()
+                histogram.observe(value)
+
+    @contextmanager
+    def scope(self):
+        """
+        Yields a registry of only what is recorded while the block runs, so a
+        stage reports its own numbers however many stages ran before it.
+        """
+        scope = Metrics(self.lock)
+        with self.lock:
+            self.scopes.append(scope)
+        try:
+            yield scope
+        finally:
+            with self.lock:
+                self.scopes.remove(scope)
+
+    @contextmanager
+    def timer(self, name):
+        """Times the block into the histogram name (seconds)."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def snapshot(self, reset=False):
+        with self.lock:
+            state = {
+                "counters": dict(sorted(self.counters.items())),
+                "histograms": {name: h.to_dict() for name, h in sorted(self.histograms.items())},
+            }
+            if reset:
+                self.counters = {}
+                self.histograms = {}
+        return state
+
+    def merge(self, state):
+        """Adds a snapshot of another registry, e.g. of a worker process."""
+        with self.lock:
+            for registry in (self, *self.scopes):
+                for name, value in state["counters"].items():
+                    registry.counters[name] = registry.counters.get(name, 0) + value
+                for name, histogram in state["histograms"].items():
+                    registry.histograms.setdefault(name, Histogram()).merge(histogram)
+
+
+METRICS = Metrics()
+
+
+def key_label(key):
+    """Short label of an API key for per-key counters, never the full key."""
+    return f"...{key[-4:]}" if key else "none"
+
+
+def summary_line(stage, elapsed, state):
+    """One line summary: every counter with its rate, every histogram's p50/p99."""
+    parts = [f"{name} {value} ({value / elapsed:.1f}/s)" if elapsed > 0 else f"{name} {value}"
+             for name, value in state["counters"].items()]
+    for name, h in state["histograms"].items():
+        if h["count"]:
+            parts.append(f"{name} p50 {h['p50'] * 1000:.0f}ms p99 {h['p99'] * 1000:.0f}ms")
+    return f"📊 [{stage}] {elapsed:.0f}s | " + " | ".join(parts)
+
+
+def _default_path(env, stage, suffix):
+    folder = os.environ.get(env)
+    return os.path.join(folder, f"{stage}{suffix}") if folder else None
+
+
+@contextmanager
+def instrumented(stage, metrics_path=None, report_seconds=None, profile_path=None, metrics=METRICS):
+    """
+    Instruments a stage run. Reports cover only what was recorded during
+    the run, not the counters of earlier stages in the same process.
+
+    Parameters:
+        stage: name of the stage in the reports
+        metrics_path: JSON file written every report_seconds and at the end
+                      (defaults to $WALKABILITY_METRICS_DIR/<stage>_metrics.json)
+        report_seconds: print a summary line this often, None only at the end
+        profile_path: dump cProfile stats of the run there, readable with pstats
+                      (defaults to $WALKABILITY_PROFILE_DIR/<stage>.prof).
+                      cProfile only sees the calling thread, the download
+                      threads show up through the latency histograms
+    """
+    metrics_path = metrics_path or _default_path(METRICS_DIR_ENV, stage, "_metrics.json")
+    profile_path = profile_path or _default_path(PROFILE_DIR_ENV, stage, ".prof")
+    with metrics.scope() as stageMetrics:
+        start = time.monotonic()
+        started = time.strftime("%Y-%m-%dT%H:%M:%S")
+
+        def report(final=False):
+            elapsed = time.monotonic() - start
+            state = stageMetrics.snapshot()
+            if final or report_seconds:
+                print(summary_line(stage, elapsed, state))
+            if metrics_path:
+                folder = os.path.dirname(os.path.abspath(metrics_path))
+                os.makedirs(folder, exist_ok=True)
+                atomic_write(metrics_path, json.dumps({
+                    "stage": stage, "started": started, "elapsed": round(elapsed, 3),
+                    "final": final, **state,
+                }, indent=2))
+
+        stop = threading.Event()
+        reporter = None
+        if report_seconds:
+            def loop():
+                while not stop.wait(report_seconds):
+                    report()
+            reporter = threading.Thread(target=loop, daemon=True)
+            reporter.start()
+
+        profiler = cProfile.Profile() if profile_path else None
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield stageMetrics
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                os.makedirs(os.path.dirname(os.path.abspath(profile_path)), exist_ok=True)
+                profiler.dump_stats(profile_path)
+            stop.set()
+            if reporter is not None:
+                reporter.join()
+            report(final=True)
+
+
+def instrument_stage(stage):
+    """
+    Decorator adding the metrics_path, metrics_seconds and profile_path
+    keyword arguments of instrumented() to a stage function.
+    """
+    def wrap(fn):
+        @functools.wraps(fn)
+        def run(*args, metrics_path=None, metrics_seconds=None, profile_path=None, **kwargs):
+            with instrumented(stage, metrics_path, metrics_seconds, profile_path):
+                return fn(*args, **kwargs)
+        return run
+    return wrap
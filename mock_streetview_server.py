@@ -0,0 +1,249 @@
+# Local stand-in for the Google Street View metadata and image endpoints
+# Answers are deterministic: the metadata of a location depends only on the
+# location (points closer than ~10 m share a panorama, like real coverage) and
+# the image of a (panorama, heading) is always the same JPEG tile. Latency can
+# be added per request, so benchmarks and offline runs of the collectors see
+# realistic round trips without touching the real API or spending quota.
+#
+#   python mock_streetview_server.py --port 8800 --latency 0.05
+#
+# then point base_url of the stages to http://127.0.0.1:8800/maps/api/streetview
+# (images) and http://127.0.0.1:8800/maps/api/streetview/metadata (metadata).
+
+import argparse
+import base64
+import hashlib
+import json
+import random
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+IMAGE_PATH = "/maps/api/streetview"
+METADATA_PATH = "/maps/api/streetview/metadata"
+STATS_PATH = "/stats"
+
+DEFAULT_OPTIONS = {
+    "latency": 0.0,        # seconds added to every answer
+    "jitter": 0.0,         # extra uniform random delay, 0..jitter seconds
+    "zero_results": 0.2,   # share of locations without a panorama
+    "grid": 4,             # decimals of the location grid panoramas snap to
+    "tiles": 32,           # distinct JPEG tiles served
+    "image_size": 400,     # tile width and height in pixels
+    "seed": 0,
+}
+
+
+def make_tiles(count, size, seed=0, quality=90):
+    """
+    Generates count JPEG street scenes: sky, a vegetation band of varying
+    height and a road, with noise so the JPEGs do not compress away.
+    """
+    from PIL import Image
+
+    rng = np.random.default_rng(seed)
+    tiles = []
+    for n in range(count):
+        image = np.empty((size, size, 3), dtype=np.uint8)
+        image[:] = (135, 170, 210)  # sky
+        horizon = size // 3
+        image[horizon:] = (110, 110, 110)  # road and buildings
+        # vegetation covers between 0 and 60 % of the picture
+        green = int(size * 0.6 * n / max(count - 1, 1))
+        image[horizon:horizon + green] = (60, 140, 50)
+        noise = rng.integers(-12, 13, image.shape, dtype=np.int16)
+        image = np.clip(image.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+        out = BytesIO()
+        Image.fromarray(image).save(out, "JPEG", quality=quality)
+        tiles.append(out.getvalue())
+    return tiles
+
+
+def _digest(text):
+    return hashlib.md5(text.encode("utf-8")).digest()
+
+
+def metadata_answer(location, zero_results=0.2, grid=4):
+    """The deterministic metadata JSON of a 'lat,lon' location."""
+    try:
+        lat, lon = (float(v) for v in location.split(","))
+    except ValueError:
+        return {"status": "INVALID_REQUEST"}
+    lat, lon = round(lat, grid), round(lon, grid)
+    digest = _digest(f"{lat:.{grid}f},{lon:.{grid}f}")
+    if digest[0] / 256 < zero_results:
+        return {"status": "ZERO_RESULTS"}
+    return {
+        "copyright": "© Mock",
+        "date": f"{2015 + digest[1] % 9}-{1 + digest[2] % 12:02d}",
+        "location": {"lat": lat, "lng": lon},
+        "pano_id": base64.urlsafe_b64encode(digest).decode("ascii")[:22],
+        "status": "OK",
+    }
+
+
+def make_handler(options, tiles, stats, lock):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status, body, content_type):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _count(self, name):
+            with lock:
+                stats[name] = stats.get(name, 0) + 1
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            query = parse_qs(url.query)
+            path = url.path.rstrip("/")
+            if path == STATS_PATH:
+                with lock:
+                    body = json.dumps(stats).encode("utf-8")
+                return self._send(200, body, "application/json")
+
+            delay = options["latency"] + random.uniform(0, options["jitter"])
+            if delay > 0:
+                time.sleep(delay)
+
+            if path == METADATA_PATH:
+                self._count("metadata")
+                answer = metadata_answer(query.get("location", [""])[0],
+                                         options["zero_results"], options["grid"])
+                return self._send(200, json.dumps(answer).encode("utf-8"), "application/json")
+            if path == IMAGE_PATH:
+                if "pano" not in query:
+                    self._count("errors")
+                    return self._send(400, b"pano required", "text/plain")
+                self._count("images")
+                tile = zlib.crc32(f"{query['pano'][0]}|{query.get('heading', ['0'])[0]}".encode("utf-8"))
+                return self._send(200, tiles[tile % len(tiles)], "image/jpeg")
+            self._count("errors")
+            self._send(404, b"not found", "text/plain")
+
+    return Handler
+
+
+def create_server(host="127.0.0.1", port=0, **options):
+    """Builds the HTTP server, call serve_forever() on it to answer requests."""
+    options = {**DEFAULT_OPTIONS, **options}
+    tiles = make_tiles(options["tiles"], options["image_size"], options["seed"])
+    handler = make_handler(options, tiles, {}, threading.Lock())
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def _serve(host, port, options, ready):
+    server = create_server(host, port, **options)
+    ready.send(server.server_address[1])
+    ready.close()
+    server.serve_forever()
+
+
+class MockStreetViewServer:
+    """
+    Mock Street View server running in a thread or in its own process.
+
+    In a separate process (process=True) the server does not compete with
+    the stage being measured for the GIL, which keeps benchmark timings clean.
+    Keyword options: see DEFAULT_OPTIONS.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, process=False, **options):
+        self.host = host
+        self.port = port
+        self.process = process
+        self.options = {**DEFAULT_OPTIONS, **options}
+        self._server = None
+        self._worker = None
+
+    @property
+    def root(self):
+        return f"http://{self.host}:{self.port}"
+
+    @property
+    def metadata_url(self):
+        return self.root + METADATA_PATH
+
+    @property
+    def image_url(self):
+        return self.root + IMAGE_PATH
+
+    def start(self):
+        if self.process:
+            import multiprocessing
+
+            receiver, sender = multiprocessing.Pipe(duplex=False)
+            self._worker = multiprocessing.Process(target=_serve, daemon=True,
+                                                   args=(self.host, self.port, self.options, sender))
+            self._worker.start()
+            self.port = receiver.recv()
+            receiver.close()
+        else:
+            self._server = create_server(self.host, self.port, **self.options)
+            self.port = self._server.server_address[1]
+            self._worker = threading.Thread(target=self._server.serve_forever, daemon=True)
+            self._worker.start()
+        return self
+
+    def stats(self):
+        """Requests answered so far, by endpoint."""
+        import requests
+
+        return requests.get(self.root + STATS_PATH, timeout=10).json()
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        elif self._worker is not None:
+            self._worker.terminate()
+            self._worker.join()
+        self._worker = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Deterministic mock of the Street View metadata and image API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8800)
+    parser.add_argument("--latency", type=float, default=DEFAULT_OPTIONS["latency"],
+                        help="seconds added to every answer")
+    parser.add_argument("--jitter", type=float, default=DEFAULT_OPTIONS["jitter"],
+                        help="extra random delay of up to this many seconds")
+    parser.add_argument("--zero-results", type=float, default=DEFAULT_OPTIONS["zero_results"],
+                        help="share of locations without a panorama")
+    parser.add_argument("--image-size", type=int, default=DEFAULT_OPTIONS["image_size"])
+    parser.add_argument("--seed", type=int, default=DEFAULT_OPTIONS["seed"])
+    return parser.parse_args(argv)
+
+
+# ------------------------------ Main function -------------------------------
+if __name__ == "__main__":
+    args = vars(parse_args())
+    host, port = args.pop("host"), args.pop("port")
+    server = create_server(host, port, **args)
+    print(f"[INFO] Mock Street View server on http://{host}:{server.server_address[1]}{IMAGE_PATH}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,99 @@
+# Panorama de-duplication between metadata collection and green view computing
+# Adjacent sample points often resolve to the same panorama. This stage collapses
+# the Pnt_start*_end*.txt metadata files to unique panoIDs for the GVI step and
+# keeps a many-to-one mapping so the results can be fanned back out to points.
+
+import csv
+import os
+
+from pipeline_records import format_line, iter_records
+
+MAPPING_COLUMNS = ["panoID", "panoDate", "lat", "lon", "point_id", "street_id", "street_name"]
+
+
+def DedupPanoMetadata(GSVinfoFolder, outputFolder, panos_per_file=1000):
+    """
+    Collapses the metadata text files of GSVinfoFolder to unique panoramas.
+
+    Writes to outputFolder:
+        Pano_start<s>_end<e>.txt: one metadata line per unique panoID, the
+            one of the first point seen, read by GreenViewComputing_ogr_6Horizon
+        pano_point_map.csv: every sample point with the panoID it resolved to
+
+    Return:
+        number of points read, number of unique panoramas
+    """
+    if not os.path.isdir(GSVinfoFolder):
+        print('[ERROR] GSV metadata folder not found.')
+        return 0, 0
+    os.makedirs(outputFolder, exist_ok=True)
+
+    panos = {}
+    n_points = 0
+    mapping_path = os.path.join(outputFolder, "pano_point_map.csv")
+    with open(mapping_path, "w", newline="", encoding="utf-8") as mapping_file:
+        mapping = csv.writer(mapping_file)
+        mapping.writerow(MAPPING_COLUMNS)
+
+        for record in iter_records(GSVinfoFolder):
+            if not all(field in record for field in ("panoDate", "lat", "lon")):
+                continue
+            n_points += 1
+            panoID = record["panoID"]
+            if panoID not in panos:
+                panos[panoID] = record
+            mapping.writerow([record.get(column, "None") for column in MAPPING_COLUMNS])
+
+    unique = list(panos.values())
+    for start in range(0, len(unique), panos_per_file):
+        end = min(start + panos_per_file, len(unique))
+        out_path = os.path.join(outputFolder, f"Pano_start{start}_end{end}.txt")
+        with open(out_path, "w", encoding="utf-8") as f:
+            for record in unique[start:end]:
+                f.write(format_line("metadata", {
+                    "street_id": "None", "street_name": "None", "point_id": "None", **record}))
+
+    print(f"[INFO] {n_points} points resolved to {len(unique)} unique panoramas "
+          f"({n_points - len(unique)} duplicates removed)")
+    return n_points, len(unique)
+
+
+def read_greenview_results(GVIResFolder):
+    """Reads the green view results of a folder into a {panoID: greenview} dict."""
+    return {record["panoID"]: f"{record['greenview']:.2f}"
+            for record in iter_records(GVIResFolder, "greenview")}
+
+
+def FanOutGreenView(GVIResFolder, mappingCsv, outputCsv):
+    """
+    Joins the per-panorama green view results back onto every sample point
+    of the mapping written by DedupPanoMetadata. Points whose panorama has no
+    result (e.g. filtered out by greenmonth) are written with an empty value.
+
+    Return:
+        number of points written
+    """
+    results = read_greenview_results(GVIResFolder)
+    n_points = 0
+    with open(mappingCsv, "r", newline="", encoding="utf-8") as src, \
+            open(outputCsv, "w", newline="", encoding="utf-8") as dst:
+        reader = csv.DictReader(src)
+        writer = csv.writer(dst)
+        writer.writerow(MAPPING_COLUMNS + ["greenview"])
+        for row in reader:
+            writer.writerow([row[column] for column in MAPPING_COLUMNS] + [results.get(row["panoID"], "")])
+            n_points += 1
+    print(f"[INFO] Green view fanned out to {n_points} points")
+    return n_points
+
+
+# ------------------------------ Main function -------------------------------
+if __name__ == "__main__":
+    GSVinfoRoot = r'C:\Treepedia_Public-master\spatial-data\metadata'
+    uniquePanoRoot = r'C:\Treepedia_Public-master\spatial-data\unique_panos'
+    outputTextPath = r'C:\Treepedia_Public-master\spatial-data\greenviewRes'
+
+    DedupPanoMetadata(GSVinfoRoot, uniquePanoRoot)
+    # run GreenViewComputing_ogr_6Horizon(uniquePanoRoot, outputTextPath, ...) then
+    FanOutGreenView(outputTextPath, os.path.join(uniquePanoRoot, "pano_point_map.csv"),
+                    os.path.join(outputTextPath, "point_greenview.csv"))
@@ -0,0 +1,332 @@
+# Typed records exchanged between the pipeline stages
+# One schema per record kind, one text codec that formats every stage's lines
+# and parses all the line layouts found in existing output folders, and a
+# compact chunked columnar binary format (.rec) with streaming reader/writer.
+
+import json
+import os
+import re
+import struct
+import zlib
+
+import numpy as np
+
+# field name -> type, in output order. "f8" floats, "i8" integers, "str" text
+SCHEMAS = {
+    "metadata": [
+        ("panoID", "str"), ("panoDate", "str"), ("lat", "f8"), ("lon", "f8"),
+        ("street_id", "str"), ("street_name", "str"), ("point_id", "i8"),
+    ],
+    "greenview": [
+        ("panoID", "str"), ("panoDate", "str"), ("lon", "f8"), ("lat", "f8"),
+        ("greenview", "f8"),
+    ],
+    # YOLO results: one row per detected object, per processed panorama and
+    # per (panorama, class) count
+    "detection": [
+        ("panoID", "str"), ("heading", "f8"), ("cls", "i8"), ("name", "str"), ("conf", "f8"),
+        ("x1", "f8"), ("y1", "f8"), ("x2", "f8"), ("y2", "f8"),
+    ],
+    "detection_pano": [
+        ("panoID", "str"), ("panoDate", "str"), ("lat", "f8"), ("lon", "f8"),
+        ("greenview", "f8"), ("images", "i8"), ("detections", "i8"),
+    ],
+    "detection_count": [
+        ("panoID", "str"), ("name", "str"), ("count", "i8"),
+    ],
+}
+
+MISSING_INT = -1
+
+# ---------------------------------------------------------------- text codec
+
+# every label used by any stage, longitude/latitude are the greenview spelling
+_LABELS = ("panoID", "panoDate", "lat", "lon", "longitude", "latitude",
+           "street_id", "street_name", "point_id", "greenview")
+_LABEL_RE = re.compile(r"(?:^|(?<=\s)|(?<=,))(" + "|".join(_LABELS) + r"): ")
+_ALIASES = {"longitude": "lon", "latitude": "lat"}
+# field name -> type over all schemas, looked up for every parsed value
+_FIELD_TYPES = dict(field for schema in SCHEMAS.values() for field in schema)
+
+
+def _convert(value, ftype):
+    if ftype == "f8":
+        return float(value)
+    if ftype == "i8":
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return MISSING_INT
+    return value
+
+
+# exact layouts written by format_line, matched in fixed field order so label
+# text inside a street name or id does not start a new field
+_METADATA_RE = re.compile(
+    r"panoID: (?P<panoID>\S+)  panoDate: (?P<panoDate>\S*)  lat: (?P<lat>\S+)  lon: (?P<lon>\S+)  "
+    r"street_id: (?P<street_id>.*?)  street_name: (?P<street_name>.*)  point_id: (?P<point_id>\S+)\s*$")
+_GREENVIEW_RE = re.compile(
+    r"panoID: (\S+) panoDate: (\S*) longitude: (\S+) latitude: (\S+), greenview: (\S+)\s*$")
+
+
+def _split_fields(line):
+    """Raw label -> text of one line, by layout."""
+    match = _METADATA_RE.match(line)
+    if match:
+        return match.groupdict()
+    match = _GREENVIEW_RE.match(line)
+    if match:
+        return dict(zip(("panoID", "panoDate", "lon", "lat", "greenview"), match.groups()))
+    if " | " in line:
+        record = {}
+        for item in line.strip().split(" | "):
+            label, sep, value = item.partition(": ")
+            label = label.strip()
+            if sep and label in _LABELS:
+                record[_ALIASES.get(label, label)] = value.strip()
+        return record
+
+    # other layouts: split at every known label
+    matches = list(_LABEL_RE.finditer(line))
+    record = {}
+    for n, match in enumerate(matches):
+        end = matches[n + 1].start() if n + 1 < len(matches) else len(line)
+        value = line[match.end():end].strip().rstrip("|,").strip()
+        record[_ALIASES.get(match.group(1), match.group(1))] = value
+    return record
+
+
+def parse_line(line, kind=None):
+    """
+    Parses one text line of any stage into a dict of typed values.
+
+    Understands the collector layout ("panoID: X  panoDate: Y  lat: .."),
+    the " | " separated layout and the green view layout
+    ("panoID: X panoDate: Y longitude: .. latitude: .., greenview: G").
+    With kind given, only lines holding every field of that schema are
+    accepted. Returns None for lines that are not records.
+    """
+    record = _split_fields(line)
+    if not record.get("panoID"):
+        return None
+
+    if kind is not None and any(name not in record for name, _ in SCHEMAS[kind]):
+        return None
+    try:
+        return {name: _convert(value, _FIELD_TYPES.get(name, "str")) for name, value in record.items()}
+    except ValueError:
+        return None
+
+
+def format_line(kind, record):
+    """Formats a record as the text line written by the stage of that kind."""
+    if kind == "metadata":
+        point_id = record.get("point_id")
+        return (f"panoID: {record['panoID']}  panoDate: {record['panoDate']}  "
+                f"lat: {record['lat']}  lon: {record['lon']}  "
+                f"street_id: {record['street_id']}  street_name: {record['street_name']}  "
+                f"point_id: {point_id if point_id != MISSING_INT else 'None'}\n")
+    if kind == "greenview":
+        return (f"panoID: {record['panoID']} panoDate: {record['panoDate']} "
+                f"longitude: {record['lon']} latitude: {record['lat']}, "
+                f"greenview: {record['greenview']:.2f}\n")
+    raise ValueError(f"unknown record kind {kind}")
+
+
+def iter_text_records(path, kind=None):
+    """Streams the records of a text file, skipping lines that do not parse."""
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        for line in f:
+            if kind == "greenview":
+                match = _GREENVIEW_RE.match(line)
+                if match:
+                    try:
+                        yield {"panoID": match.group(1), "panoDate": match.group(2),
+                               "lon": float(match.group(3)), "lat": float(match.group(4)),
+                               "greenview": float(match.group(5))}
+                        continue
+                    except ValueError:
+                        pass
+            record = parse_line(line, kind)
+            if record is not None:
+                yield record
+
+# ------------------------------------------------------- columnar binary files
+
+MAGIC = b"GSVREC1\n"
+
+
+def _write_block(f, header, payload=b""):
+    raw = json.dumps(header).encode("utf-8")
+    f.write(struct.pack("<I", len(raw)))
+    f.write(raw)
+    f.write(payload)
+
+
+def _read_block_header(f):
+    size = f.read(4)
+    if len(size) < 4:
+        return None
+    size = struct.unpack("<I", size)[0]
+    raw = f.read(size)
+    if len(raw) < size:
+        # block cut short by an interrupted writer
+        return None
+    return json.loads(raw.decode("utf-8"))
+
+
+def _encode_column(values, ftype):
+    if ftype == "str":
+        encoded = [str(v).encode("utf-8") for v in values]
+        offsets = np.zeros(len(encoded) + 1, dtype="<u4")
+        np.cumsum([len(e) for e in encoded], out=offsets[1:])
+        raw = offsets.tobytes() + b"".join(encoded)
+    else:
+        raw = np.asarray(values, dtype="<" + ftype).tobytes()
+    return zlib.compress(raw, 1)
+
+
+def _decode_column(buf, ftype, rows):
+    raw = zlib.decompress(buf)
+    if ftype != "str":
+        return np.frombuffer(raw, dtype="<" + ftype, count=rows)
+    offsets = np.frombuffer(raw, dtype="<u4", count=rows + 1)
+    blob = raw[(rows + 1) * 4:]
+    return np.array([blob[offsets[i]:offsets[i + 1]].decode("utf-8") for i in range(rows)], dtype=object)
+
+
+class RecordWriter:
+    """
+    Streaming writer of a .rec columnar file. Rows are buffered and written
+    as one compressed chunk per column every chunk_rows rows (chunk_rows=None
+    leaves flushing to the caller).
+    """
+
+    def __init__(self, path, kind, chunk_rows=10000):
+        self.kind = kind
+        self.schema = SCHEMAS[kind]
+        self.chunk_rows = chunk_rows
+        self.columns = {name: [] for name, _ in self.schema}
+        self.rows = 0
+        self.file = open(path, "wb")
+        self.file.write(MAGIC)
+        _write_block(self.file, {"kind": kind, "schema": self.schema})
+        self.file.flush()
+
+    def write(self, record):
+        for name, ftype in self.schema:
+            value = record.get(name)
+            if value is None:
+                value = MISSING_INT if ftype == "i8" else (np.nan if ftype == "f8" else "None")
+            self.columns[name].append(value)
+        self.rows += 1
+        if self.chunk_rows and self.rows >= self.chunk_rows:
+            self.flush()
+
+    def write_columns(self, columns):
+        """Writes equally long arrays (one per schema field) as a chunk."""
+        self.flush()
+        rows = len(columns[self.schema[0][0]])
+        self._write_chunk({name: columns[name] for name, _ in self.schema}, rows)
+
+    def flush(self):
+        if self.rows:
+            self._write_chunk(self.columns, self.rows)
+            self.columns = {name: [] for name, _ in self.schema}
+            self.rows = 0
+        self.file.flush()
+
+    def _write_chunk(self, columns, rows):
+        buffers = [_encode_column(columns[name], ftype) for name, ftype in self.schema]
+        _write_block(self.file, {"rows": rows, "sizes": [len(b) for b in buffers]}, b"".join(buffers))
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class RecordReader:
+    """
+    Streaming reader of a .rec columnar file, one chunk at a time. A file
+    cut off before its first chunk by an interrupted writer reads as empty.
+    """
+
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        magic = self.file.read(len(MAGIC))
+        if magic != MAGIC and not MAGIC.startswith(magic):
+            self.file.close()
+            raise ValueError(f"{path} is not a record file")
+        header = _read_block_header(self.file) if magic == MAGIC else None
+        self.kind = header["kind"] if header else None
+        self.schema = [tuple(field) for field in header["schema"]] if header else []
+
+    def iter_chunks(self):
+        """
+        Yields each chunk as a dict of column arrays. A trailing chunk left
+        incomplete by an interrupted writer is ignored.
+        """
+        while self.schema:
+            header = _read_block_header(self.file)
+            if header is None:
+                return
+            payload = self.file.read(sum(header["sizes"]))
+            if len(payload) < sum(header["sizes"]):
+                return
+            chunk = {}
+            offset = 0
+            for (name, ftype), size in zip(self.schema, header["sizes"]):
+                chunk[name] = _decode_column(payload[offset:offset + size], ftype, header["rows"])
+                offset += size
+            yield chunk
+
+    def __iter__(self):
+        for chunk in self.iter_chunks():
+            names = list(chunk)
+            for row in zip(*(chunk[name] for name in names)):
+                yield dict(zip(names, row))
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def iter_records(path, kind=None):
+    """
+    Streams the records of a .rec file, a text file or every .rec/.txt file
+    of a folder (sorted by name), whatever layout they were written in.
+    """
+    if os.path.isdir(path):
+        for name in sorted(os.listdir(path)):
+            if name.endswith((".txt", ".rec")):
+                yield from iter_records(os.path.join(path, name), kind)
+        return
+    if path.endswith(".rec"):
+        with RecordReader(path) as reader:
+            yield from reader
+    else:
+        yield from iter_text_records(path, kind)
+
+
+def pack_records(src, out_path, kind, chunk_rows=10000):
+    """
+    Packs the text output of a stage (file or folder) into one .rec file.
+    Returns the number of records written.
+    """
+    count = 0
+    with RecordWriter(out_path, kind, chunk_rows) as writer:
+        for record in iter_records(src, kind):
+            writer.write(record)
+            count += 1
+    return count
@@ -0,0 +1,387 @@
+# Fused image pipeline: every Street View image is downloaded and decoded
+# once and handed to all enabled analyzers (green view, YOLO, ...).
+#
+#   parse -> dedup -> fetch -> decode -> analyzers -> sinks
+#
+# Each stage runs in its own thread(s) and the stages are connected by
+# bounded queues, so memory stays flat however many panoramas there are.
+
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import numpy as np
+
+from gsv_api import IMAGE_URL, KeyPool, fetch_image, load_keys
+from pipeline_records import format_line, iter_records
+
+HEADINGS = 360 / 6 * np.array([0, 1, 2, 3, 4, 5])
+
+_DONE = object()  # end of stream marker passed down the queues
+
+
+# ------------------------------------------------------------------ analyzers
+
+class GreenViewAnalyzer:
+    """Green view index of a panorama, the mean vegetation share of its headings."""
+
+    name = "greenview"
+
+    def __init__(self, classify_threads=None):
+        self.classify_threads = classify_threads
+
+    def analyze(self, batch):
+        from vegetation import VegetationClassification, VegetationClassificationBatch, stack_images
+
+        results = [-1] * len(batch)
+        complete = [n for n, (_, _, images) in enumerate(batch) if all(im is not None for im in images)]
+        # every heading of every complete panorama of the batch in one call
+        stack = stack_images([im for n in complete for im in batch[n][2]])
+        allPercents = VegetationClassificationBatch(stack, self.classify_threads) if stack is not None else None
+        start = 0
+        for n in complete:
+            images = batch[n][2]
+            if allPercents is not None:
+                percents = allPercents[start:start + len(images)]
+                start += len(images)
+            else:
+                percents = [VegetationClassification(im) for im in images]
+            greenPercent = 0.0
+            for percent in percents:
+                if percent == -1:
+                    greenPercent = -1000
+                    break
+                greenPercent += float(percent)
+            results[n] = greenPercent / len(images) if greenPercent >= 0 else -1
+        return results
+
+
+class YoloAnalyzer:
+    """YOLO detections of the headings of a panorama, batched across panoramas."""
+
+    name = "yolo"
+
+    def __init__(self, weights='yolov5_custom.pt', conf=0.25, batch_size=32, threads=None):
+        from yolo_detector import YoloDetector
+
+        self.detector = YoloDetector(weights=weights, conf=conf, batch_size=batch_size, threads=threads)
+
+    def analyze(self, batch):
+        from yolo_detector import split_detections
+
+        complete = [n for n, (_, _, images) in enumerate(batch) if all(im is not None for im in images)]
+        images = [im for n in complete for im in batch[n][2]]
+        perImage = split_detections(self.detector.detect(images), len(images))
+        results = [None] * len(batch)
+        start = 0
+        for n in complete:
+            count = len(batch[n][2])
+            detections = np.concatenate(perImage[start:start + count]).copy()
+            detections["image"] -= start
+            start += count
+            results[n] = detections
+        return results
+
+
+# ---------------------------------------------------------------------- sinks
+
+class GreenViewTextSink:
+    """
+    Appends green view results to a GV_*.txt file in the layout of
+    GreenViewComputing_ogr_6Horizon. Panoramas already in the file are done.
+    """
+
+    def __init__(self, path, sync_every=50):
+        from GreenView_Calculate1 import read_journal
+
+        self.done = read_journal(path)
+        self.file = open(path, "a")
+        self.sync_every = sync_every
+        self.written = 0
+
+    def write(self, pano, greenViewVal):
+        self.file.write(format_line("greenview", {
+            "panoID": pano["panoID"], "panoDate": pano["panoDate"],
+            "lon": pano["lon"], "lat": pano["lat"], "greenview": greenViewVal,
+        }))
+        self.file.flush()
+        self.done[pano["panoID"]] += 1
+        self.written += 1
+        if self.written % self.sync_every == 0:
+            os.fsync(self.file.fileno())
+
+    def close(self):
+        os.fsync(self.file.fileno())
+        self.file.close()
+
+
+class DetectionSink:
+    """Stores YOLO detections in a DetectionStore folder."""
+
+    def __init__(self, folder, names):
+        from detection_store import DetectionStore
+
+        self.store = DetectionStore(folder)
+        self.done = self.store.done
+        self.names = names
+
+    def write(self, pano, detections):
+        # panoramas with a failed heading are left for a later run
+        if detections is not None:
+            pano = {**pano, "greenview": pano.get("greenview", np.nan)}
+            self.store.add(pano, HEADINGS, detections, self.names())
+
+    def close(self):
+        self.store.close()
+
+
+# --------------------------------------------------------------------- stages
+
+def _put(q, item, stop=None, timeout=0.5):
+    """
+    q.put that gives up once the stop event is set, so a producer cannot
+    block forever on a queue whose consumer has died. Return: True if put.
+    """
+    while True:
+        try:
+            q.put(item, timeout=timeout)
+            return True
+        except queue.Full:
+            if stop is not None and stop.is_set():
+                return False
+
+
+def iter_queue(q, stop=None, timeout=0.5):
+    """Items of q up to _DONE, or until the stop event is set."""
+    while True:
+        try:
+            item = q.get(timeout=timeout)
+        except queue.Empty:
+            if stop is not None and stop.is_set():
+                return
+            continue
+        if item is _DONE:
+            return
+        yield item
+
+
+class _Stage(threading.Thread):
+    """
+    Pipeline thread; an exception is kept and re-raised by the consumer.
+    The last argument of target is its output queue, stop an optional event
+    telling the stage to give up on a full queue.
+    """
+
+    def __init__(self, target, *args, stop=None):
+        super().__init__(daemon=True)
+        self.target = target
+        self.args = args
+        self.stop = stop
+        self.error = None
+
+    def run(self):
+        try:
+            self.target(*self.args)
+        except BaseException as e:
+            self.error = e
+            # let the downstream stages stop
+            _put(self.args[-1], _DONE, self.stop)
+
+
+def iter_panoramas(source, greenmonth):
+    """
+    Panoramas taken in greenmonth, each panoID once. source is a metadata
+    folder/file or an iterable of metadata records.
+    """
+    seen = set()
+    records = iter_records(source) if isinstance(source, str) else source
+    for record in records:
+        if not all(field in record for field in ("panoDate", "lat", "lon")):
+            continue
+        if record["panoDate"][-2:] not in greenmonth or record["panoID"] in seen:
+            continue
+        seen.add(record["panoID"])
+        yield record
+
+
+def _parse(source, greenmonth, sinks, stop, out):
+    for pano in iter_panoramas(source, greenmonth):
+        if all(pano["panoID"] in sink.done for sink in sinks):
+            continue
+        if not _put(out, pano, stop):
+            return
+    _put(out, _DONE, stop)
+
+
+def _fetch(executor, download, stop, inq, out):
+    for pano in iter_queue(inq, stop):
+        futures = [executor.submit(download, pano["panoID"], heading) for heading in HEADINGS]
+        # blocks once the queue is full, which bounds the downloads in flight
+        if not _put(out, (pano, futures), stop):
+            return
+    _put(out, _DONE, stop)
+
+
+def _decode(executor, stop, inq, out):
+    from PIL import Image
+
+    def decode(content):
+        if content is None:
+            return None
+        try:
+            return np.asarray(Image.open(BytesIO(content)).convert("RGB"))
+        except Exception as e:
+            print(f"[ERROR] Failed to decode image: {e}")
+            return None
+
+    for pano, futures in iter_queue(inq, stop):
+        contents = [future.result() for future in futures]
+        if not _put(out, (pano, HEADINGS, list(executor.map(decode, contents))), stop):
+            return
+    _put(out, _DONE, stop)
+
+
+def StreetViewPipeline(GSVinfoFolder, outputFolder, greenmonth, key_file, analyzers=("greenview", "yolo"),
+                       max_in_flight=24, rate_per_key=10, base_url=IMAGE_URL,
+                       image_cache_root=None, image_cache_bytes=None, offline=False,
+                       queue_size=16, batch_panos=8, decode_threads=4, classify_threads=None,
+                       yolo_weights='yolov5_custom.pt', yolo_batch=32, torch_threads=None,
+                       panoramas=None):
+    """
+    Downloads the six headings of every unique panorama of the metadata files
+    in GSVinfoFolder once and runs every enabled analyzer on them.
+
+    Parameters:
+        analyzers: names of the analyzers to run ("greenview", "yolo") or
+                   (analyzer, sink) pairs of custom ones; an analyzer has an
+                   analyze(batch) method mapping a list of (pano, headings,
+                   images) to one result per panorama, a sink has a done set
+                   of panoIDs, write(pano, result) and close(). Analyzers run
+                   in order and each result is also stored in the pano dict
+                   under the analyzer's name for the sinks after it
+        queue_size: capacity of the queues between stages, in panoramas
+        batch_panos: panoramas handed to the analyzers at once
+        decode_threads: threads decoding JPEGs
+        panoramas: optional iterable of metadata records read instead of
+                   GSVinfoFolder, e.g. fed by a metadata stage still running
+
+    Writes to outputFolder:
+        GV_pipeline.txt: green view results, in the GreenViewComputing layout
+        yolo_results/: the DetectionStore of the YOLO detections
+
+    Panoramas already in every sink are skipped, so an interrupted run is
+    resumed by running it again. Return: number of panoramas processed.
+    """
+    if panoramas is None and not os.path.isdir(GSVinfoFolder):
+        print('[ERROR] GSV metadata folder not found.')
+        return 0
+    if offline and not image_cache_root:
+        print('[ERROR] Offline mode needs an image cache folder.')
+        return 0
+    os.makedirs(outputFolder, exist_ok=True)
+
+    stages = []
+    for analyzer in analyzers:
+        if analyzer == "greenview":
+            stages.append((GreenViewAnalyzer(classify_threads),
+                           GreenViewTextSink(os.path.join(outputFolder, 'GV_pipeline.txt'))))
+        elif analyzer == "yolo":
+            yolo = YoloAnalyzer(yolo_weights, batch_size=yolo_batch, threads=torch_threads)
+            stages.append((yolo, DetectionSink(os.path.join(outputFolder, 'yolo_results'),
+                                               lambda: yolo.detector.names)))
+        else:
+            stages.append(tuple(analyzer))
+    sinks = [sink for _, sink in stages]
+
+    key_pool = KeyPool(load_keys(key_file), rate_per_key)
+    image_cache = None
+    if image_cache_root:
+        from image_cache import ImageCache
+        image_cache = ImageCache(image_cache_root, image_cache_bytes, offline)
+
+    def download(panoID, heading):
+        try:
+            if image_cache is not None:
+                return image_cache.fetch(panoID, heading, key_pool, base_url=base_url)
+            return fetch_image(panoID, heading, key_pool, base_url=base_url)
+        except Exception as e:
+            print(f"[ERROR] Failed to fetch pano: {panoID}, heading: {heading}: {e}")
+            return None
+
+    panoQueue = queue.Queue(queue_size)
+    fetchedQueue = queue.Queue(queue_size)
+    decodedQueue = queue.Queue(queue_size)
+    fetchPool = ThreadPoolExecutor(max_workers=max_in_flight)
+    decodePool = ThreadPoolExecutor(max_workers=decode_threads)
+    # set when the analyzers stop, so no stage stays blocked on a queue
+    stop = threading.Event()
+    threads = [
+        _Stage(_parse, GSVinfoFolder if panoramas is None else panoramas, greenmonth, sinks, stop, panoQueue,
+               stop=stop),
+        _Stage(_fetch, fetchPool, download, stop, panoQueue, fetchedQueue, stop=stop),
+        _Stage(_decode, decodePool, stop, fetchedQueue, decodedQueue, stop=stop),
+    ]
+    for thread in threads:
+        thread.start()
+
+    processed = 0
+    finished = False
+    try:
+        while not finished:
+            # wait for one panorama, then take whatever else is ready
+            batch = []
+            item = decodedQueue.get()
+            while item is not _DONE:
+                batch.append(item)
+                if len(batch) >= batch_panos:
+                    break
+                try:
+                    item = decodedQueue.get_nowait()
+                except queue.Empty:
+                    break
+            finished = item is _DONE
+            if not batch:
+                continue
+
+            for analyzer, sink in stages:
+                todo = [n for n, (pano, _, _) in enumerate(batch) if pano["panoID"] not in sink.done]
+                if not todo:
+                    continue
+                results = analyzer.analyze([batch[n] for n in todo])
+                for n, result in zip(todo, results):
+                    # later sinks see the results of the earlier analyzers
+                    batch[n][0][getattr(analyzer, "name", "result")] = result
+                    sink.write(batch[n][0], result)
+            processed += len(batch)
+            if processed % 100 < len(batch):
+                print(f"[INFO] {processed} panoramas processed")
+
+        for thread in threads:
+            if thread.error is not None:
+                raise thread.error
+        for thread in threads:
+            thread.join()
+    finally:
+        stop.set()
+        fetchPool.shutdown(cancel_futures=True)
+        decodePool.shutdown()
+        for sink in sinks:
+            sink.close()
+        if image_cache is not None:
+            print(f"[INFO] {image_cache.stats()}")
+
+    print(f"[INFO] Pipeline done: {processed} panoramas processed")
+    return processed
+
+
+# ------------------------------ Main function -------------------------------
+if __name__ == "__main__":
+    GSVinfoRoot = r'C:\Treepedia_Public-master\spatial-data\metadata'
+    outputRoot = r'C:\Treepedia_Public-master\spatial-data\pipelineRes'
+    greenmonth = ['01','02','03','04','05','06','07','08','09','10','11','12']
+    key_file = r'C:\Treepedia_Public-master\Treepedia\keys1.txt'
+    imageCacheRoot = r'C:\Treepedia_Public-master\spatial-data\image_cache'
+
+    StreetViewPipeline(GSVinfoRoot, outputRoot, greenmonth, key_file, image_cache_root=imageCacheRoot)
@@ -0,0 +1,344 @@
+# Vectorized street sampling engine used by createPoints
+# Projects road coordinates in bulk, interpolates sample distances with NumPy
+# and back-projects all sampled points of a run in a single call.
+
+import ast
+from functools import lru_cache
+
+import numpy as np
+
+# Highway types createPoints and the city pipeline do not sample:
+# major roads, highways and footpaths
+EXCLUDED_HIGHWAYS = {
+    'trunk_link', 'tertiary', 'motorway', 'motorway_link', 'steps', None, ' ',
+    'pedestrian', 'primary', 'primary_link', 'footway', 'tertiary_link',
+    'trunk', 'secondary', 'secondary_link', 'bridleway', 'service'
+}
+
+
+@lru_cache(maxsize=None)
+def get_transformer(src_epsg, dst_epsg):
+    """
+    Returns a cached pyproj Transformer between two EPSG codes.
+    Coordinates are always handled in (x, y) = (lon, lat) order.
+    """
+    from pyproj import Transformer
+    return Transformer.from_crs(f"EPSG:{src_epsg}", f"EPSG:{dst_epsg}", always_xy=True)
+
+
+def geometry_parts(geometry):
+    """
+    Returns the coordinate arrays of a GeoJSON-like (Multi)LineString mapping
+    as a list of (n, 2) float arrays, one per part.
+    """
+    gtype = geometry['type']
+    if gtype == 'LineString':
+        parts = [geometry['coordinates']]
+    elif gtype == 'MultiLineString':
+        parts = geometry['coordinates']
+    else:
+        raise ValueError(f"unsupported geometry type {gtype}")
+    return [np.asarray(part, dtype='float64')[:, :2] for part in parts if len(part)]
+
+
+def highway_values(value):
+    """
+    Returns the highway tags of a road as a list. OSMnx keeps merged edges
+    with several tags as a list, which ends up in shapefiles either as a real
+    list or as its string form "['primary', 'residential']".
+    """
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    if isinstance(value, str) and value.startswith('['):
+        try:
+            parsed = ast.literal_eval(value)
+            if isinstance(parsed, (list, tuple)):
+                return list(parsed)
+        except (ValueError, SyntaxError):
+            pass
+    return [value]
+
+
+def iter_clean_segments(inshp, excluded_highways):
+    """
+    Streams the street segments of inshp that are not of an excluded highway
+    type, as (geometry, street_id, street_name) tuples. A segment carrying
+    several highway tags is dropped if any of them is excluded. Layers without
+    a highway field are filtered on their first attribute instead.
+    """
+    import fiona
+
+    with fiona.open(inshp) as source:
+        fields = list(source.schema['properties'].keys())
+        tag_field = 'highway' if 'highway' in fields else fields[0]
+        for feat in source:
+            props = feat['properties']
+            tags = highway_values(props.get(tag_field))
+            if any(tag in excluded_highways for tag in tags):
+                continue
+            yield (feat['geometry'], props.get('osm_id', 'NA'), props.get('name', 'NA'))
+
+
+def line_distances(line_len, mini_dist):
+    """
+    Returns the distances along a line of length line_len at which points are
+    sampled: the midpoint for short lines, otherwise every mini_dist meters.
+    """
+    if line_len < mini_dist:
+        return np.array([line_len / 2])
+    return np.arange(0, int(line_len), mini_dist, dtype='float64')
+
+
+def interpolate_parts(parts, distances):
+    """
+    Interpolates points at the given distances along a line made of one or
+    more parts (projected coordinates). Parts are walked in order, the gap
+    between consecutive parts does not count towards the length.
+    """
+    xs = np.concatenate([p[:, 0] for p in parts])
+    ys = np.concatenate([p[:, 1] for p in parts])
+    dx = np.diff(xs)
+    dy = np.diff(ys)
+    seg_len = np.sqrt(dx * dx + dy * dy)
+
+    # zero out the jumps between the end of one part and the start of the next
+    ends = np.cumsum([len(p) for p in parts])[:-1] - 1
+    seg_len[ends] = 0.0
+
+    if len(seg_len) == 0 or seg_len.sum() == 0:
+        return np.full(len(distances), xs[0]), np.full(len(distances), ys[0])
+
+    cum_len = np.concatenate(([0.0], np.cumsum(seg_len)))
+    idx = np.searchsorted(cum_len, distances, side='right') - 1
+    idx = np.clip(idx, 0, len(seg_len) - 1)
+    # skip zero-length segments so the fraction below is well defined
+    valid = np.flatnonzero(seg_len > 0)
+    idx = valid[np.clip(np.searchsorted(valid, idx), 0, len(valid) - 1)]
+
+    frac = (distances - cum_len[idx]) / seg_len[idx]
+    frac = np.clip(frac, 0.0, 1.0)
+    px = xs[idx] + frac * dx[idx]
+    py = ys[idx] + frac * dy[idx]
+    return px, py
+
+
+def project_parts(segments, src_epsg, dst_epsg):
+    """
+    Projects the parts of many segments with one transformer call.
+    segments is a list of part lists as returned by geometry_parts.
+    """
+    flat = [part for parts in segments for part in parts]
+    if not flat:
+        return segments
+    coords = np.concatenate(flat)
+    x, y = get_transformer(src_epsg, dst_epsg).transform(coords[:, 0], coords[:, 1])
+    projected = np.column_stack((x, y))
+
+    out = []
+    start = 0
+    for parts in segments:
+        new_parts = []
+        for part in parts:
+            new_parts.append(projected[start:start + len(part)])
+            start += len(part)
+        out.append(new_parts)
+    return out
+
+
+def sample_segments(segments, mini_dist, src_epsg=4326, metric_epsg=3857):
+    """
+    Samples points every mini_dist meters along a list of segments.
+
+    Parameters:
+        segments: list of (geometry, street_id, street_name) tuples, geometry
+                  being a GeoJSON-like (Multi)LineString mapping in src_epsg
+        mini_dist: sampling interval in meters
+
+    Return:
+        x, y: metric coordinates of all sampled points (NumPy arrays)
+        seg_idx: index of the segment each point belongs to
+    """
+    parts_list = []
+    keep = []
+    for i, (geometry, _, _) in enumerate(segments):
+        try:
+            parts = geometry_parts(geometry)
+            if parts:
+                parts_list.append(parts)
+                keep.append(i)
+        except Exception as e:
+            print(f"[ERROR] Skipping segment due to error: {e}")
+
+    projected = project_parts(parts_list, src_epsg, metric_epsg)
+
+    xs, ys, owners = [], [], []
+    for i, parts in zip(keep, projected):
+        try:
+            line_len = float(sum(np.sqrt((np.diff(p, axis=0) ** 2).sum(axis=1)).sum() for p in parts))
+            distances = line_distances(line_len, mini_dist)
+            px, py = interpolate_parts(parts, distances)
+        except Exception as e:
+            print(f"[ERROR] Skipping segment due to error: {e}")
+            continue
+        xs.append(px)
+        ys.append(py)
+        owners.append(np.full(len(px), i, dtype='int64'))
+
+    if not xs:
+        empty = np.empty(0)
+        return empty, empty, np.empty(0, dtype='int64')
+    return np.concatenate(xs), np.concatenate(ys), np.concatenate(owners)
+
+
+def partition_segments(segments, n_chunks, mode='range'):
+    """
+    Splits segment indices into at most n_chunks groups.
+
+    mode='range' cuts the feature sequence into contiguous ranges,
+    mode='tile' bins segments on a square grid by their first vertex so each
+    chunk covers a compact area of the city.
+    """
+    n = len(segments)
+    n_chunks = max(1, min(n_chunks, n))
+    if mode == 'range':
+        bounds = np.linspace(0, n, n_chunks + 1).astype('int64')
+        return [np.arange(bounds[k], bounds[k + 1]) for k in range(n_chunks)]
+    if mode != 'tile':
+        raise ValueError(f"unknown partition mode {mode}")
+
+    anchors = np.empty((n, 2))
+    for i, (geometry, _, _) in enumerate(segments):
+        try:
+            anchors[i] = geometry_parts(geometry)[0][0]
+        except Exception:
+            anchors[i] = np.nan
+    anchors = np.nan_to_num(anchors, nan=0.0)
+
+    side = int(np.ceil(np.sqrt(n_chunks)))
+    lo = anchors.min(axis=0)
+    span = np.maximum(anchors.max(axis=0) - lo, 1e-12)
+    cells = np.minimum((anchors - lo) / span * side, side - 1).astype('int64')
+    tile_id = cells[:, 1] * side + cells[:, 0]
+    order = np.argsort(tile_id, kind='stable')
+    splits = np.flatnonzero(np.diff(tile_id[order])) + 1
+    return [chunk for chunk in np.split(order, splits) if len(chunk)]
+
+
+def _sample_chunk(args):
+    """Process pool worker: samples one chunk of segments."""
+    indices, geometries, mini_dist, src_epsg, metric_epsg = args
+    chunk = [(geometry, None, None) for geometry in geometries]
+    x, y, local_idx = sample_segments(chunk, mini_dist, src_epsg, metric_epsg)
+    return x, y, indices[local_idx]
+
+
+def sample_segments_parallel(segments, mini_dist, workers=None, partition='range',
+                             chunks_per_worker=4, src_epsg=4326, metric_epsg=3857):
+    """
+    Samples segments in a process pool. The road layer is split into chunks
+    (see partition_segments), each chunk is sampled by a worker and the results
+    are merged back in feature order, so the returned points and therefore the
+    point_id numbering are identical to sample_segments.
+    """
+    import os
+    from concurrent.futures import ProcessPoolExecutor
+
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1 or len(segments) < 2:
+        return sample_segments(segments, mini_dist, src_epsg, metric_epsg)
+
+    chunks = partition_segments(segments, workers * chunks_per_worker, partition)
+    tasks = [
+        (idx, [segments[i][0] for i in idx], mini_dist, src_epsg, metric_epsg)
+        for idx in chunks
+    ]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(_sample_chunk, tasks))
+
+    x = np.concatenate([r[0] for r in results])
+    y = np.concatenate([r[1] for r in results])
+    seg_idx = np.concatenate([r[2] for r in results]).astype('int64')
+    # chunks keep the per-segment point order, a stable sort on the segment
+    # index restores the sequential numbering
+    order = np.argsort(seg_idx, kind='stable')
+    return x[order], y[order], seg_idx[order]
+
+
+def thin_points(x, y, min_spacing):
+    """
+    Greedy spatial thinning on a grid hash. Points are visited in order and a
+    point is dropped when one already kept lies within min_spacing (same units
+    as x, y, i.e. meters of the sampling projection), across all segments.
+
+    Return:
+        keep: boolean mask of the points that are kept
+    """
+    n = len(x)
+    keep = np.zeros(n, dtype=bool)
+    if n == 0:
+        return keep
+
+    min_sq = float(min_spacing) ** 2
+    cx = np.floor(x / min_spacing).astype('int64')
+    cy = np.floor(y / min_spacing).astype('int64')
+    grid = {}
+    for i in range(n):
+        gx, gy = cx[i], cy[i]
+        px, py = x[i], y[i]
+        close = False
+        for ox in (-1, 0, 1):
+            for oy in (-1, 0, 1):
+                for j in grid.get((gx + ox, gy + oy), ()):
+                    if (x[j] - px) ** 2 + (y[j] - py) ** 2 < min_sq:
+                        close = True
+                        break
+                if close:
+                    break
+            if close:
+                break
+        if not close:
+            keep[i] = True
+            grid.setdefault((gx, gy), []).append(i)
+    return keep
+
+
+def to_lonlat(x, y, metric_epsg=3857):
+    """Back-projects metric coordinates to WGS84 lon/lat in one call."""
+    if len(x) == 0:
+        return x, y
+    return get_transformer(metric_epsg, 4326).transform(x, y)
+
+
+def write_points(outshp, lon, lat, seg_idx, segments, first_id=0):
+    """
+    Writes sampled points to a WGS84 point shapefile with the point_id,
+    street_id and street_name attributes. Returns the number of points written.
+    """
+    import fiona
+    from fiona.crs import from_epsg
+
+    schema = {
+        'geometry': 'Point',
+        'properties': {
+            'point_id': 'int',
+            'street_id': 'str',
+            'street_name': 'str'
+        },
+    }
+
+    def records():
+        for n in range(len(lon)):
+            _, street_id, street_name = segments[seg_idx[n]]
+            yield {
+                'geometry': {'type': 'Point', 'coordinates': (float(lon[n]), float(lat[n]))},
+                'properties': {
+                    'point_id': first_id + n,
+                    'street_id': str(street_id),
+                    'street_name': str(street_name)
+                }
+            }
+
+    with fiona.Env():
+        with fiona.open(outshp, 'w', crs=from_epsg(4326), driver='ESRI Shapefile', schema=schema) as output:
+            output.writerecords(records())
+    return len(lon)
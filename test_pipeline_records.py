@@ -0,0 +1,44 @@
+# Round trips of the pipeline_records text codec
+#
+#   python -m pytest -q test_pipeline_records.py
+
+from pipeline_records import format_line, iter_text_records, parse_line
+
+# street names holding label text must not split into extra fields
+TRICKY_NAME = "Main lat: 5, point_id: 3 Road  lon: 7 | greenview: 1"
+
+METADATA = {
+    "panoID": "AbCdEfGhIjKlMnOpQrStUv", "panoDate": "2019-06",
+    "lat": 22.3193, "lon": 114.1694,
+    "street_id": "[12345, 67890]", "street_name": TRICKY_NAME, "point_id": 42,
+}
+GREENVIEW = {
+    "panoID": "AbCdEfGhIjKlMnOpQrStUv", "panoDate": "2019-06",
+    "lon": 114.1694, "lat": 22.3193, "greenview": 31.25,
+}
+
+
+def test_metadata_round_trip_with_labels_in_street_name():
+    assert parse_line(format_line("metadata", METADATA), "metadata") == METADATA
+
+
+def test_metadata_round_trip_with_labels_in_street_id():
+    record = dict(METADATA, street_id="way lat: 1  point_id: 2")
+    assert parse_line(format_line("metadata", record), "metadata") == record
+
+
+def test_greenview_round_trip():
+    assert parse_line(format_line("greenview", GREENVIEW), "greenview") == GREENVIEW
+
+
+def test_pipe_layout():
+    line = f"panoID: X | panoDate: 2019-06 | lat: 1.5 | lon: 2.5 | street_name: {TRICKY_NAME.replace(' | ', ' ')}"
+    record = parse_line(line)
+    assert record["lat"] == 1.5 and record["lon"] == 2.5
+    assert record["street_name"] == TRICKY_NAME.replace(" | ", " ")
+
+
+def test_iter_text_records_keeps_tricky_lines(tmp_path):
+    path = tmp_path / "metadata.txt"
+    path.write_text(format_line("metadata", METADATA) * 3, encoding="utf-8")
+    assert list(iter_text_records(path, "metadata")) == [METADATA] * 3